@@ -0,0 +1,86 @@
+'''
+límites de color comunes (vmin/vmax) por grupo de variable, estadística y
+nivel, a partir de percentiles de todas las rebanadas del lote
+los percentiles se estiman en una sola pasada con una muestra aleatoria de
+tamaño fijo (reservorio), sin guardar las rebanadas en memoria; los límites
+se guardan en un cache JSON junto al manifiesto con la huella de las entradas.
+'''
+import os
+import json
+import hashlib
+import numpy as np
+
+class StreamingQuantiles:
+    '''
+    muestra aleatoria uniforme de a lo más size valores de todo lo agregado:
+    cada valor recibe una llave aleatoria y se conservan las size llaves menores
+    '''
+    def __init__(self, size=100000, seed=0):
+        self.size=size
+        self.rng=np.random.default_rng(seed)
+        self.keys=np.empty(0)
+        self.values=np.empty(0)
+        self.count=0
+
+    def add(self, values):
+        values=np.ma.masked_invalid(values).compressed().astype(float)
+        if values.size==0:
+            return
+        self.count+=values.size
+        keys=np.concatenate([self.keys, self.rng.random(values.size)])
+        values=np.concatenate([self.values, values])
+        if keys.size>self.size:
+            keep=np.argpartition(keys, self.size)[:self.size]
+            keys, values=keys[keep], values[keep]
+        self.keys, self.values=keys, values
+
+    def quantiles(self, percentiles):
+        if self.count==0:
+            return None
+        return [float(v) for v in np.percentile(self.values, percentiles)]
+
+def group_key(args):
+    '''
+    grupo que comparte escala: variable, estadística y nivel
+    '''
+    return '{}|{}|{}'.format(args.var_name, args.stat, args.level)
+
+def signature(fprints, percentiles):
+    '''
+    huella del grupo: huellas de sus figuras (opciones y entradas) y percentiles
+    '''
+    raw=json.dumps([sorted(json.dumps(f, sort_keys=True) for f in fprints), percentiles])
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+class ScaleCache:
+    '''
+    cache JSON {grupo: {'signature':..., 'vmin':..., 'vmax':...}},
+    por omisión en Figuras/.scales.json
+    '''
+    def __init__(self, path='Figuras/.scales.json'):
+        self.path=path
+        self.entries={}
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.entries=json.load(f)
+            except ValueError:
+                print('Cache de escalas dañado, se ignora:', path)
+
+    def get(self, key, sign):
+        entry=self.entries.get(key)
+        if entry==None or entry['signature']!=sign:
+            return None
+        return entry['vmin'], entry['vmax']
+
+    def update(self, key, sign, vmin, vmax):
+        self.entries[key]={'signature':sign, 'vmin':vmin, 'vmax':vmax}
+
+    def save(self):
+        dirname=os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        tmp=self.path+'.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
@@ -0,0 +1,75 @@
+'''
+tiempo, memoria y equivalencia visual de map_pcolor con y sin max_cells
+en mallas de alta resolución (campo sintético suave con máscara de tierra)
+las mallas deben tener más de max_cells=8*dpi celdas por eje; si la malla no se
+reduce la comparación no prueba nada y termina con error
+
+    python3 benchmarks/bench_decimate.py
+    python3 benchmarks/bench_decimate.py --resolution 0.01 --method max
+'''
+import os
+import sys
+import time
+import argparse as ap
+import tracemalloc
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import matplotlib
+matplotlib.use('Agg')
+from map_plots import map_pcolor, decimate_grid
+import synthetic
+
+def render(lon, lat, var, dpi, **kwargs):
+    '''
+    dibuja la figura y regresa la imagen RGBA, el tiempo y la memoria máxima
+    '''
+    tracemalloc.start()
+    t0=time.perf_counter()
+    ax, fig=map_pcolor(lon, lat, var, cmap='jet', vmin=20, vmax=32,
+            plot_land=False, plot_bathy=False, pyplot=False, **kwargs)
+    fig.set_dpi(dpi)
+    fig.canvas.draw()
+    elapsed=time.perf_counter()-t0
+    peak=tracemalloc.get_traced_memory()[1]/2**20
+    tracemalloc.stop()
+    image=np.asarray(fig.canvas.buffer_rgba(), dtype=float)/255.
+    return image, elapsed, peak
+
+def main(argv=None):
+    parser=ap.ArgumentParser(description='Decimación de mallas en map_pcolor')
+    parser.add_argument("--resolution", type=float, nargs='+', default=[0.01, 0.005],
+            help="Resoluciones de malla en grados")
+    parser.add_argument("--method", default='mean', choices=['mean','max'])
+    parser.add_argument("--dpi", type=int, default=200)
+    parser.add_argument("--max_diff", type=float, default=0.02,
+            help="Diferencia media máxima por pixel (0-1) para considerar equivalentes")
+    args=parser.parse_args(argv)
+
+    extent=synthetic.GOM_EXTENT
+    status=0
+    for res in args.resolution:
+        lon=np.arange(extent[0], extent[1]+res/2, res)
+        lat=np.arange(extent[2], extent[3]+res/2, res)
+        xx, yy=np.meshgrid(lon, lat)
+        var=np.ma.masked_where(synthetic.land_mask(xx, yy),
+                26+3*np.sin(xx/2.)*np.cos(yy/3.))
+        max_cells=8*args.dpi
+        reduced=decimate_grid(lon, lat, var, max_cells, args.method)[2].shape
+        if reduced==var.shape:
+            print('ERROR: {:.3f}° ({}x{}) no supera max_cells={}, la malla no se reduce'.format(
+                res, len(lat), len(lon), max_cells))
+            status=1
+            continue
+        full, t_full, m_full=render(lon, lat, var, args.dpi)
+        dec, t_dec, m_dec=render(lon, lat, var, args.dpi,
+                max_cells=max_cells, decimate_method=args.method)
+        diff=float(np.abs(full-dec).mean())
+        print('{:.3f}° ({}x{} -> {}x{}): completa {:.2f} s {:.0f} MB, reducida {:.2f} s {:.0f} MB, diferencia {:.4f}'.format(
+            res, len(lat), len(lon), reduced[0], reduced[1], t_full, m_full, t_dec, m_dec, diff))
+        if diff>args.max_diff:
+            print('ERROR: la imagen reducida difiere más de', args.max_diff)
+            status=1
+    return status
+
+if __name__=='__main__':
+    sys.exit(main())
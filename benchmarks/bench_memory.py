@@ -0,0 +1,105 @@
+'''
+prueba de regresión de memoria: la memoria residente debe mantenerse estable
+al generar N figuras seguidas con plot_fig.plot_task, el mismo camino que una
+sección de plot_fig.py (lectura del NetCDF, costas, batimetría, guardado y
+cierre de la figura), sobre el archivo y los shapefiles sintéticos de
+synthetic.py (no requiere red ni datos del modelo)
+
+    python3 benchmarks/bench_memory.py -n 50
+    python3 benchmarks/bench_memory.py -n 50 --agg
+'''
+import os
+import sys
+import gc
+import argparse as ap
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import matplotlib
+matplotlib.use('Agg')
+import cartopy
+import synthetic
+
+def rss_mb():
+    '''
+    memoria residente actual del proceso en MB
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            pages=int(f.read().split()[1])
+        return pages*os.sysconf('SC_PAGE_SIZE')/2**20
+    except (OSError, ValueError):
+        import resource
+        #en Linux ru_maxrss está en KB, en macOS en bytes
+        maxrss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss/2**20 if sys.platform=='darwin' else maxrss/2**10
+
+def section_args(path, level, agg=False):
+    '''
+    Namespace de plot_fig de una sección con el archivo sintético
+    '''
+    import plot_fig
+    options=['--var_name=temperatura', '--var_alias=pot_temp', '--tipo=clim',
+            '--stat=media', '--modelo=HYCOM', '--filename='+path,
+            '--lat=Latitude', '--long=Longitude', '--depth=Depth',
+            '--level={}'.format(level)]
+    if agg:
+        options.append('--agg')
+    return plot_fig.parser.parse_args(options)
+
+def render(args):
+    '''
+    grafica la sección con plot_task; error si alguna figura falló
+    '''
+    import plot_fig
+    for figname, seconds, error, stages in plot_fig.plot_task(args):
+        if error!=None:
+            raise RuntimeError('{} falló:\n{}'.format(figname, error))
+
+def main(argv=None):
+    parser=ap.ArgumentParser(description='Regresión de memoria de plot_fig')
+    parser.add_argument("-n", type=int, default=40, help="Número de figuras")
+    parser.add_argument("--warmup", type=int, default=15,
+            help="Figuras iniciales que no se toman en cuenta")
+    parser.add_argument("--resolution", default='1/12', choices=list(synthetic.RESOLUTIONS),
+            help="Resolución de la malla sintética")
+    parser.add_argument("--level", type=int, default=100, help="Nivel a graficar")
+    parser.add_argument("--max_growth", type=float, default=20,
+            help="Crecimiento máximo permitido en MB después del calentamiento")
+    parser.add_argument("--agg", action="store_true", help="Figuras fuera de pyplot")
+    args=parser.parse_args(argv)
+
+    cwd=os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        cartopy.config['data_dir']=synthetic.make_shapefiles(os.path.join(tmp, 'cartopy'))
+        import geom_cache
+        geom_cache.CACHE_DIR=os.path.join(tmp, 'geom_cache')
+        path=synthetic.make_dataset(os.path.join(tmp, 'grid.nc'),
+                synthetic.RESOLUTIONS[args.resolution])
+        #plot_fig escribe en Figuras/ bajo la carpeta actual
+        os.chdir(tmp)
+        try:
+            section=section_args(path, args.level, args.agg)
+            for i in range(args.warmup):
+                render(section)
+            #fuentes, colormaps, geometrías, etc. se cargan en las primeras figuras
+            gc.collect()
+            base=rss_mb()
+            samples=[]
+            for i in range(args.n):
+                render(section)
+                gc.collect()
+                samples.append(rss_mb())
+        finally:
+            import plot_fig
+            plot_fig.close_caches()
+            os.chdir(cwd)
+    growth=samples[-1]-base
+    print('RSS inicial {:.1f} MB, final {:.1f} MB, máximo {:.1f} MB, crecimiento {:.1f} MB'.format(
+        base, samples[-1], max(samples), growth))
+    if growth>args.max_growth:
+        print('ERROR: la memoria crece más de {} MB en {} figuras'.format(args.max_growth, args.n))
+        return 1
+    return 0
+
+if __name__=='__main__':
+    sys.exit(main())
@@ -0,0 +1,186 @@
+'''
+pruebas de desempeño de map_plots y de la lectura de datos de plot_fig
+con archivos NetCDF y shapefiles sintéticos (no requiere red ni datos)
+
+mide por separado cada etapa para cada resolución de malla:
+    load      - lectura de un nivel con nc_reader.read_slice
+    pcolormesh- pcolormesh y dibujo
+    features  - addCoastlines + addBathy leyendo los shapefiles
+    features_cache - addCoastlines + addBathy desde geom_cache
+    ticks     - addCoordinateTicks y dibujo
+    savefig   - savefig(dpi=200, bbox_inches='tight') de una figura de map_pcolor
+                ya construida (la construcción no se mide)
+
+    python3 benchmarks/bench_render.py --save_baseline   # guarda la referencia
+    python3 benchmarks/bench_render.py                   # compara con la referencia
+la referencia registra la máquina y las versiones; sin referencia la comparación
+termina con error (código 2) para no pasar sin medir nada.
+'''
+import os
+import sys
+import io
+import platform
+import json
+import time
+import argparse as ap
+import tempfile
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import matplotlib
+matplotlib.use('Agg')
+import cartopy
+import cartopy.crs as ccrs
+import netCDF4 as nc
+import synthetic
+
+BASELINE=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+def timeit(func, repeat):
+    '''
+    mediana de repeat ejecuciones de func en segundos
+    '''
+    times=[]
+    for i in range(repeat):
+        t0=time.perf_counter()
+        func()
+        times.append(time.perf_counter()-t0)
+    return float(np.median(times))
+
+def stages(path, extent):
+    '''
+    funciones de cada etapa sobre el archivo sintético path
+    '''
+    import map_plots
+    import geom_cache
+    from nc_reader import read_slice
+    crs=ccrs.PlateCarree()
+
+    def load():
+        with nc.Dataset(path) as root:
+            return read_slice(root, 'pot_temp', 'Longitude', 'Latitude', 'Depth', level=100)
+    lon, lat, var, z=load()
+
+    def draw(build):
+        fig, ax=map_plots.start_plot(crs, pyplot=False)
+        build(ax)
+        ax.set_extent(extent, crs=crs)
+        fig.canvas.draw()
+
+    def pcolormesh():
+        draw(lambda ax: ax.pcolormesh(lon, lat, var, cmap='jet', vmin=20, vmax=30))
+
+    def features():
+        def build(ax):
+            map_plots.addCoastlines(ax, True, 'GSHHS')
+            map_plots.addBathy(ax, True)
+        draw(build)
+
+    def features_cache():
+        def build(ax):
+            map_plots.addCoastlines(ax, True, 'GSHHS', extent=extent)
+            map_plots.addBathy(ax, True, extent=extent)
+        draw(build)
+    #primera llamada fuera de la medición: llena el cache
+    geom_cache.warm(extent, crs)
+
+    def ticks():
+        draw(lambda ax: map_plots.addCoordinateTicks(ax, lon, lat, 8))
+
+    #la figura se construye fuera de la medición; cada savefig la dibuja completa
+    ax, fig=map_plots.map_pcolor(lon, lat, var, cmap='jet', vmin=20, vmax=30,
+            extent=extent, pyplot=False)
+
+    def savefig():
+        fig.savefig(io.BytesIO(), format='png', bbox_inches='tight', dpi=200)
+
+    return [('load', load),
+            ('pcolormesh', pcolormesh),
+            ('features', features),
+            ('features_cache', features_cache),
+            ('ticks', ticks),
+            ('savefig', savefig),
+            ]
+
+def run(resolutions, repeat):
+    results={}
+    with tempfile.TemporaryDirectory() as tmp:
+        cartopy.config['data_dir']=synthetic.make_shapefiles(os.path.join(tmp, 'cartopy'))
+        import geom_cache
+        geom_cache.CACHE_DIR=os.path.join(tmp, 'geom_cache')
+        for name in resolutions:
+            path=synthetic.make_dataset(os.path.join(tmp, 'grid.nc'),
+                    synthetic.RESOLUTIONS[name])
+            results[name]={}
+            for stage, func in stages(path, synthetic.GOM_EXTENT):
+                results[name][stage]=timeit(func, repeat)
+                print('{:>5} {:>15} {:8.3f} s'.format(name, stage, results[name][stage]))
+            os.remove(path)
+    return results
+
+def compare(results, baseline, tolerance, floor):
+    '''
+    regresa las etapas más lentas que la referencia por más de tolerance
+    (fracción) y de floor segundos
+    '''
+    regressions=[]
+    for name, times in results.items():
+        for stage, t in times.items():
+            ref=baseline.get(name, {}).get(stage)
+            if ref==None:
+                continue
+            if t>ref*(1+tolerance) and t-ref>floor:
+                regressions.append((name, stage, ref, t))
+    return regressions
+
+def machine():
+    '''
+    máquina y versiones con que se midió la referencia
+    '''
+    return {'platform':platform.platform(),
+            'processor':platform.processor() or platform.machine(),
+            'cpus':os.cpu_count(),
+            'python':platform.python_version(),
+            'numpy':np.__version__,
+            'matplotlib':matplotlib.__version__,
+            'cartopy':cartopy.__version__,
+            }
+
+def main(argv=None):
+    parser=ap.ArgumentParser(description='Pruebas de desempeño de map_plots')
+    parser.add_argument("--resolution", nargs='+', default=list(synthetic.RESOLUTIONS),
+            choices=list(synthetic.RESOLUTIONS), help="Resoluciones de malla")
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticiones por etapa")
+    parser.add_argument("--baseline", default=BASELINE, help="Archivo JSON de referencia")
+    parser.add_argument("--save_baseline", action="store_true",
+            help="Guarda los tiempos como nueva referencia")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+            help="Fracción de aumento permitida respecto a la referencia")
+    parser.add_argument("--floor", type=float, default=0.02,
+            help="Diferencia mínima en segundos para considerar regresión")
+    args=parser.parse_args(argv)
+
+    results=run(args.resolution, args.repeat)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'versions':machine(), **results}, f, indent=1)
+        print('Referencia guardada en', args.baseline)
+        return 0
+    if not os.path.exists(args.baseline):
+        print('No existe la referencia', args.baseline, '(usar --save_baseline en esta máquina)')
+        return 2
+    with open(args.baseline) as f:
+        baseline=json.load(f)
+    current=machine()
+    for key, value in baseline.get('versions', {}).items():
+        if current.get(key)!=value:
+            print('Aviso: la referencia se midió con {}={} (ahora {})'.format(key, value, current.get(key)))
+    regressions=compare(results, baseline, args.tolerance, args.floor)
+    for name, stage, ref, t in regressions:
+        print('REGRESIÓN {} {}: {:.3f} s -> {:.3f} s'.format(name, stage, ref, t))
+    if regressions:
+        return 1
+    print('Sin regresiones respecto a', args.baseline)
+    return 0
+
+if __name__=='__main__':
+    sys.exit(main())
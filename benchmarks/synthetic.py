@@ -0,0 +1,89 @@
+'''
+datos sintéticos para las pruebas de desempeño: archivos NetCDF con la
+estructura de las salidas HYCOM y shapefiles que sustituyen a GSHHS y
+NaturalEarth, para correr sin red ni datos del modelo
+'''
+import os
+import numpy as np
+import netCDF4 as nc
+import shapefile
+
+#dominio del Golfo de México usado en plot_fig
+GOM_EXTENT=[-98, -77, 18, 32]
+
+#resoluciones en grados: 1/4 (malla actual) hasta 1/25
+RESOLUTIONS={'1/4':0.25, '1/12':1/12., '1/25':0.04}
+
+DEPTHS=[0, 10, 20, 30, 50, 75, 100, 125, 150, 200, 250, 300, 400, 500, 600, 700,
+        800, 900, 1000, 1100, 1200, 1300, 1400, 1500, 1750, 2000, 2500, 3000,
+        3500, 4000]
+
+def make_dataset(path, resolution, extent=GOM_EXTENT, depths=DEPTHS, seed=0):
+    '''
+    archivo con pot_temp(MT, Depth, Latitude, Longitude) y nombres de HYCOM
+    '''
+    lon=np.arange(extent[0], extent[1]+resolution/2, resolution)
+    lat=np.arange(extent[2], extent[3]+resolution/2, resolution)
+    rng=np.random.default_rng(seed)
+    with nc.Dataset(path, 'w') as root:
+        root.createDimension('MT', 1)
+        root.createDimension('Depth', len(depths))
+        root.createDimension('Latitude', len(lat))
+        root.createDimension('Longitude', len(lon))
+        root.createVariable('Depth', 'f4', ('Depth',))[:]=depths
+        root.createVariable('Latitude', 'f4', ('Latitude',))[:]=lat
+        root.createVariable('Longitude', 'f4', ('Longitude',))[:]=lon
+        var=root.createVariable('pot_temp', 'f4', ('MT','Depth','Latitude','Longitude'),
+                fill_value=-999., chunksizes=(1, 1, len(lat), len(lon)))
+        var.units='degC'
+        xx, yy=np.meshgrid(lon, lat)
+        land=land_mask(xx, yy)
+        for k, z in enumerate(depths):
+            field=28-z/200.+np.sin(xx/2.)+np.cos(yy/3.)+rng.normal(0, 0.1, xx.shape)
+            var[0, k]=np.ma.masked_where(land, field)
+    return path
+
+def land_mask(lon, lat):
+    '''
+    tierra sintética: península de Yucatán y Florida como rectángulos
+    '''
+    return (((lon>-92)&(lon<-87)&(lat<21))|
+            ((lon>-83)&(lon<-80)&(lat>25)&(lat<31)))
+
+def _write_polygons(path, rings):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    writer=shapefile.Writer(path[:-4], shapeType=shapefile.POLYGON)
+    writer.field('id', 'N')
+    for i, ring in enumerate(rings):
+        #orden horario: anillo exterior en shapefile
+        writer.poly([ring[::-1] if _area(ring)>0 else ring])
+        writer.record(i)
+    writer.close()
+
+def _area(ring):
+    x=np.array([p[0] for p in ring])
+    y=np.array([p[1] for p in ring])
+    return 0.5*np.sum(x[:-1]*y[1:]-x[1:]*y[:-1])
+
+def make_shapefiles(data_dir, npoints=2000):
+    '''
+    escribe en data_dir (cartopy.config['data_dir']) los shapefiles de costa y
+    batimetría que buscan addCoastlines y addBathy; npoints controla el
+    número de vértices para que el costo se parezca al de las costas reales
+    '''
+    base=os.path.join(data_dir, 'shapefiles')
+    t=np.linspace(0, 2*np.pi, npoints)
+    #costa irregular alrededor de la tierra sintética
+    def blob(lon0, lat0, rx, ry):
+        r=1+0.05*np.sin(40*t)
+        return [(float(lon0+rx*r[i]*np.cos(t[i])), float(lat0+ry*r[i]*np.sin(t[i])))
+                for i in range(npoints)]
+    land=[blob(-89.5, 19, 2.5, 2), blob(-81.5, 28, 1.5, 3)]
+    _write_polygons(os.path.join(base, 'gshhs', 'f', 'GSHHS_f_L1.shp'), land)
+    _write_polygons(os.path.join(base, 'natural_earth', 'physical', 'ne_10m_land.shp'), land)
+    names=['K_200', 'J_1000', 'I_2000', 'H_3000', 'G_4000', 'F_5000']
+    for i, name in enumerate(names):
+        ring=blob(-90, 25, 8-i, 6-0.8*i)
+        _write_polygons(os.path.join(base, 'natural_earth', 'physical',
+            'ne_10m_bathymetry_'+name+'.shp'), [ring])
+    return data_dir
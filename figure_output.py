@@ -0,0 +1,137 @@
+'''
+etapa de guardado de las figuras
+    fmt='png'   - PNG RGBA con nivel de compresión configurable (0-9)
+    fmt='png8'  - PNG con paleta de 256 colores; las paletas tienen pocos colores
+                  y el archivo resulta mucho más pequeño
+    fmt='webp'  - WebP sin pérdida
+con bbox='fija' la figura se dibuja una sola vez y se recorta a un bbox que se
+calcula con la primera figura de cada diseño (layout) y se reutiliza; con
+bbox='tight' se calcula en cada figura. Con background=True la codificación se
+hace en un hilo mientras se dibuja la siguiente figura (Pillow libera el GIL al
+comprimir).
+
+    writer=FigureWriter()
+    writer.save(fig, 'Figuras/sst', fmt='png8', bbox='fija', layout=('sst',))
+    writer.wait()
+'''
+import traceback
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from timing import span
+
+FORMATS={'png':'.png', 'png8':'.png', 'webp':'.webp'}
+
+#margen alrededor del bbox, igual que pad_inches de savefig
+PAD_INCHES=0.1
+
+def extension(fmt):
+    return FORMATS[fmt or 'png']
+
+def encode(image, path, fmt, compress_level=None, dpi=200):
+    '''
+    escribe el arreglo RGBA (alto, ancho, 4) en path
+    '''
+    from PIL import Image
+    img=Image.fromarray(image, 'RGBA')
+    if fmt=='webp':
+        img.save(path, 'WEBP', lossless=True, method=0 if compress_level==None else min(compress_level, 6))
+        return
+    options={'dpi':(dpi, dpi)}
+    if compress_level!=None:
+        options['compress_level']=compress_level
+    if fmt=='png8':
+        img=img.quantize(256, method=Image.Quantize.FASTOCTREE)
+    img.save(path, 'PNG', **options)
+
+class FigureWriter:
+    '''
+    guarda figuras; conserva los bbox calculados y, en segundo plano, a lo más
+    una figura pendiente de codificar. Los errores del segundo plano se guardan
+    con el nombre de su figura (failures) y wait() los entrega
+    '''
+    def __init__(self):
+        self.bboxes={}
+        self.pool=None
+        self.pending=None
+        self.failures={}
+
+    def crop_box(self, fig, renderer, dpi, bbox, layout):
+        '''
+        (x0, y0, x1, y1) en pixeles de la imagen dibujada
+        '''
+        if bbox=='fija' and layout in self.bboxes:
+            inches=self.bboxes[layout]
+        else:
+            with span('tightbbox'):
+                inches=fig.get_tightbbox(renderer).padded(PAD_INCHES)
+            if bbox=='fija':
+                self.bboxes[layout]=inches
+        width, height=fig.canvas.get_width_height()
+        x0=max(int(np.floor(inches.x0*dpi)), 0)
+        x1=min(int(np.ceil(inches.x1*dpi)), width)
+        #el origen de la imagen es la esquina superior
+        y0=max(height-int(np.ceil(inches.y1*dpi)), 0)
+        y1=min(height-int(np.floor(inches.y0*dpi)), height)
+        return x0, y0, x1, y1
+
+    def save(self, fig, path, fmt=None, compress_level=None, bbox=None,
+            background=False, layout=None, dpi=200, name=None):
+        '''
+        guarda fig en path (sin extensión) y regresa la ruta con extensión
+        layout: llave de las figuras con el mismo diseño (mismo bbox con bbox='fija')
+        name: nombre de la figura con que se reporta un error en segundo plano
+        '''
+        fmt=fmt or 'png'
+        path+=extension(fmt)
+        if fmt=='png' and compress_level==None and bbox in (None, 'tight') and not background:
+            fig.savefig(path, bbox_inches='tight', dpi=dpi)
+            return path
+        with span('draw'):
+            fig.set_dpi(dpi)
+            fig.canvas.draw()
+            renderer=fig.canvas.get_renderer()
+        x0, y0, x1, y1=self.crop_box(fig, renderer, dpi, bbox, layout)
+        image=np.array(renderer.buffer_rgba())[y0:y1, x0:x1]
+        if not background:
+            with span('encode'):
+                encode(image, path, fmt, compress_level, dpi)
+            return path
+        #el error de la figura anterior queda en failures; esta se guarda igual
+        self.finish()
+        if self.pool==None:
+            self.pool=ThreadPoolExecutor(max_workers=1)
+        self.pending=(name or path, path,
+                self.pool.submit(encode, image, path, fmt, compress_level, dpi))
+        return path
+
+    def finish(self):
+        '''
+        espera la figura pendiente; su error se guarda en failures
+        '''
+        if self.pending==None:
+            return
+        name, path, future=self.pending
+        self.pending=None
+        with span('encode_wait'):
+            try:
+                future.result()
+            except Exception:
+                self.failures[name]='Error al guardar {}:\n{}'.format(path, traceback.format_exc())
+
+    def wait(self):
+        '''
+        espera la figura pendiente y regresa {nombre: error} de las figuras
+        que no se pudieron guardar en segundo plano desde la última llamada
+        '''
+        self.finish()
+        failures=self.failures
+        self.failures={}
+        return failures
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            if self.pool!=None:
+                self.pool.shutdown()
+                self.pool=None
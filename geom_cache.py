@@ -0,0 +1,176 @@
+'''
+cache de geometrías de costa y batimetría ya recortadas y proyectadas
+las geometrías se guardan en disco (WKB) con llave dataset, nombre, escala y
+proyección más el dominio ampliado a grados enteros, y se memorizan en el
+proceso entre figuras. Cualquier dominio contenido en uno ya guardado usa esa
+entrada, así que pre-calentar el dominio completo sirve para todas las mallas
+(u y v, recortes, mallas reducidas) que caen dentro de él.
+
+pre-calentar el cache (sin figuras):
+    python3 geom_cache.py --extent -98 -77 18 32
+'''
+import os
+import glob
+import math
+import pickle
+import hashlib
+import argparse as ap
+import cartopy.crs as ccrs
+import cartopy.feature as cfeature
+import shapely.wkb
+from shapely.geometry import box
+
+#capas batimétricas de NaturalEarth que usa addBathy
+BATHY_LAYERS=['bathymetry_K_200',
+        'bathymetry_J_1000',
+        'bathymetry_I_2000',
+        'bathymetry_H_3000',
+        'bathymetry_G_4000',
+        'bathymetry_F_5000',
+        ]
+
+#margen en grados alrededor del dominio para que el recorte no se vea
+MARGIN=1.0
+
+CACHE_DIR=os.environ.get('CIGOM_GEOM_CACHE',
+        os.path.join(os.path.expanduser('~'), '.cache', 'plot_cigom_ioa'))
+
+_memo={}
+
+def _source_feature(dataset, name, scale):
+    '''
+    feature de cartopy que lee los shapefiles originales
+    '''
+    if dataset=='GSHHS':
+        return cfeature.GSHHSFeature(scale=scale, levels=[int(name)])
+    elif dataset=='NaturalEarth':
+        return cfeature.NaturalEarthFeature('physical', name, scale)
+    raise ValueError('Dataset desconocido: '+str(dataset))
+
+def cache_key(dataset, name, scale, crs):
+    '''
+    llave de la capa en una proyección; el dominio va aparte (cache_domain)
+    '''
+    srs=crs.proj4_init if hasattr(crs, 'proj4_init') else str(crs)
+    raw=repr((dataset, str(name), scale, srs))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+def cache_domain(extent):
+    '''
+    dominio en grados enteros que contiene a extent, para que las mallas con
+    límites ligeramente distintos compartan entrada
+    '''
+    lonmin, lonmax, latmin, latmax=(float(e) for e in extent)
+    return (math.floor(lonmin), math.ceil(lonmax),
+            max(math.floor(latmin), -90), min(math.ceil(latmax), 90))
+
+def contains(outer, inner):
+    return outer[0]<=inner[0] and outer[1]>=inner[1] and \
+            outer[2]<=inner[2] and outer[3]>=inner[3]
+
+def area(domain):
+    return (domain[1]-domain[0])*(domain[3]-domain[2])
+
+def cache_path(key, domain):
+    return os.path.join(CACHE_DIR, '{}_{}_{}_{}_{}.pkl'.format(key, *domain))
+
+def disk_domains(key):
+    '''
+    dominios guardados en disco para la llave
+    '''
+    domains=[]
+    for path in glob.glob(os.path.join(CACHE_DIR, key+'_*.pkl')):
+        try:
+            domain=tuple(int(v) for v in os.path.basename(path)[len(key)+1:-4].split('_'))
+        except ValueError:
+            continue
+        if len(domain)==4:
+            domains.append(domain)
+    return domains
+
+def find_domain(key, domain):
+    '''
+    el menor dominio en memoria o en disco que contiene a domain (o None)
+    '''
+    for domains in ([d for k, d in _memo if k==key], disk_domains(key)):
+        found=[d for d in domains if contains(d, domain)]
+        if found:
+            return min(found, key=area)
+    return None
+
+def load_geometries(dataset, name, scale, extent, crs=ccrs.PlateCarree()):
+    '''
+    regresa la lista de geometrías recortadas a un dominio que contiene a
+    extent y proyectadas a crs; busca primero en memoria, luego en disco
+    (cualquier dominio que lo contenga) y al final en los shapefiles
+    '''
+    key=cache_key(dataset, name, scale, crs)
+    domain=cache_domain(extent)
+    domain=find_domain(key, domain) or domain
+    if (key, domain) in _memo:
+        return _memo[(key, domain)]
+    path=cache_path(key, domain)
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            geoms=[shapely.wkb.loads(g) for g in pickle.load(f)]
+    else:
+        geoms=build_geometries(dataset, name, scale, domain, crs)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp=path+'.'+str(os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump([shapely.wkb.dumps(g) for g in geoms], f)
+        os.replace(tmp, path)
+    _memo[(key, domain)]=geoms
+    return geoms
+
+def build_geometries(dataset, name, scale, extent, crs=ccrs.PlateCarree()):
+    '''
+    lee los shapefiles, recorta al dominio (con margen) y proyecta
+    '''
+    lonmin, lonmax, latmin, latmax=extent
+    clip_extent=(lonmin-MARGIN, lonmax+MARGIN,
+            max(latmin-MARGIN, -90), min(latmax+MARGIN, 90))
+    clip=box(clip_extent[0], clip_extent[2], clip_extent[1], clip_extent[3])
+    feature=_source_feature(dataset, name, scale)
+    src_crs=feature.crs
+    geoms=[]
+    for geom in feature.intersecting_geometries(clip_extent):
+        geom=geom.intersection(clip)
+        if geom.is_empty:
+            continue
+        if crs!=src_crs:
+            geom=crs.project_geometry(geom, src_crs)
+            if geom.is_empty:
+                continue
+        geoms.append(geom)
+    return geoms
+
+def cached_feature(dataset, name, scale, extent, crs=ccrs.PlateCarree(), **kwargs):
+    '''
+    ShapelyFeature con las geometrías del cache, lista para ax.add_feature
+    kwargs son los estilos de matplotlib (edgecolor, facecolor, ...)
+    '''
+    geoms=load_geometries(dataset, name, scale, extent, crs)
+    return cfeature.ShapelyFeature(geoms, crs, **kwargs)
+
+def warm(extent, crs=ccrs.PlateCarree(), land=True, bathy=True):
+    '''
+    genera las entradas del cache que usan addCoastlines y addBathy
+    '''
+    if land:
+        load_geometries('GSHHS', 1, 'full', extent, crs)
+        load_geometries('NaturalEarth', 'land', '10m', extent, crs)
+    if bathy:
+        for name in BATHY_LAYERS:
+            load_geometries('NaturalEarth', name, '10m', extent, crs)
+
+if __name__=='__main__':
+    parser=ap.ArgumentParser(description='Pre-calienta el cache de geometrías')
+    parser.add_argument("--extent", type=float, nargs=4, required=True,
+            metavar=('LONMIN','LONMAX','LATMIN','LATMAX'),
+            help="Dominio de las figuras")
+    parser.add_argument("--crs", default="PlateCarree",
+            help="Proyección de cartopy (sin argumentos)")
+    args=parser.parse_args()
+    warm(args.extent, getattr(ccrs, args.crs)())
+    print('Cache:', CACHE_DIR)
@@ -0,0 +1,296 @@
+'''
+archivos de trabajos en YAML, TOML o JSON, alternativa a los .inf de ConfigParser
+las llaves son las opciones de plot_fig.py sin '--'; defaults se aplica a todos
+los trabajos y matrix genera un trabajo por cada combinación de sus valores
+(los valores pueden ser diccionarios de varias opciones). Las cadenas pueden
+usar las demás opciones del trabajo con {nombre}:
+
+    defaults:
+      modelo: HYCOM
+      lat: Latitude
+      long: Longitude
+      depth: Depth
+    jobs:
+      - var_name: temperatura
+        var_alias: pot_temp
+        tipo: mensual
+        stat: promedio
+        filename: ../climmensual_hycom_temp_{mes:02d}.nc
+        level: [0, 100]
+        matrix:
+          mes: [1, 2, 3]
+
+todas las opciones, archivos, variables, coordenadas y niveles se validan antes
+de graficar y se reportan juntos todos los errores.
+'''
+import os
+import json
+import glob
+import difflib
+import itertools
+import numpy as np
+from nc_reader import find_level
+
+JOB_EXTENSIONS=['.yaml', '.yml', '.toml', '.json']
+
+#opciones obligatorias en cada trabajo
+REQUIRED=['var_name', 'tipo', 'stat', 'modelo']
+
+#opciones de plot_fig.py que no aplican en un archivo de trabajos
+EXCLUDED=['help', 'config_file', 'check', 'scales']
+
+class JobError(ValueError):
+    pass
+
+def is_job_file(path):
+    return os.path.splitext(path)[1].lower() in JOB_EXTENSIONS
+
+def read_file(path):
+    '''
+    contenido del archivo de trabajos según su extensión
+    '''
+    ext=os.path.splitext(path)[1].lower()
+    try:
+        if ext in ('.yaml', '.yml'):
+            import yaml
+            with open(path) as f:
+                return yaml.safe_load(f)
+        if ext=='.toml':
+            import tomllib
+            with open(path, 'rb') as f:
+                return tomllib.load(f)
+        if ext=='.json':
+            with open(path) as f:
+                return json.load(f)
+    except ImportError as err:
+        raise JobError('No se puede leer {}: {}'.format(path, err))
+    except Exception as err:
+        #errores de sintaxis de yaml, toml o json, o archivo inexistente
+        raise JobError('Error al leer {}:\n{}'.format(path, err))
+    raise JobError('Formato de trabajos desconocido (yaml, toml o json): '+path)
+
+def suggestion(name, names):
+    close=difflib.get_close_matches(name, names, n=1)
+    return ' (¿{}?)'.format(close[0]) if close else ''
+
+def expand(spec):
+    '''
+    lista de (número de trabajo, opciones) con defaults y cada combinación de matrix
+    '''
+    if not isinstance(spec, dict) or not isinstance(spec.get('jobs'), list):
+        raise JobError("El archivo debe tener una lista 'jobs'")
+    unknown=set(spec)-{'defaults', 'jobs'}
+    if unknown:
+        raise JobError('Llaves desconocidas: '+', '.join(sorted(unknown)))
+    defaults=spec.get('defaults') or {}
+    expanded=[]
+    for number, job in enumerate(spec['jobs'], 1):
+        if not isinstance(job, dict):
+            raise JobError('trabajo {}: se esperaba un diccionario de opciones'.format(number))
+        job=dict(job)
+        matrix=job.pop('matrix', None) or {}
+        names=list(matrix)
+        for name in names:
+            if not isinstance(matrix[name], list):
+                raise JobError('trabajo {}: matrix.{} debe ser una lista'.format(number, name))
+        for combo in itertools.product(*[matrix[name] for name in names]):
+            options=dict(defaults)
+            options.update(job)
+            for name, value in zip(names, combo):
+                if isinstance(value, dict):
+                    options.update(value)
+                else:
+                    options[name]=value
+            expanded.append((number, options))
+    return expanded
+
+def convert(action, value):
+    '''
+    valor de la opción con el tipo y valores permitidos de la opción de argparse
+    '''
+    if action.nargs==0:
+        if not isinstance(value, bool):
+            raise JobError('se esperaba true o false')
+        return value
+    if isinstance(value, bool):
+        raise JobError('no es una opción true/false')
+    if action.nargs not in (None, '?'):
+        values=value if isinstance(value, list) else [value]
+        if isinstance(action.nargs, int) and len(values)!=action.nargs:
+            raise JobError('se esperaban {} valores'.format(action.nargs))
+        return [convert_one(action, v) for v in values]
+    if isinstance(value, list):
+        #listas de niveles o meses, como --level=0,50
+        value=','.join(str(v) for v in value)
+    return convert_one(action, value)
+
+def convert_one(action, value):
+    if action.type!=None:
+        try:
+            value=action.type(str(value))
+        except Exception as err:
+            raise JobError('valor inválido {!r}: {}'.format(value, err))
+    elif not isinstance(value, str):
+        value=str(value)
+    if action.choices!=None and value not in action.choices:
+        raise JobError('{!r} no es válido, opciones: {}{}'.format(value,
+            ', '.join(str(c) for c in action.choices),
+            suggestion(str(value), [str(c) for c in action.choices])))
+    return value
+
+def make_args(options, parser):
+    '''
+    Namespace de plot_fig con las opciones del trabajo; regresa (args, errores)
+    '''
+    actions={action.dest:action for action in parser._actions if action.dest not in EXCLUDED}
+    args=parser.parse_args([])
+    errors=[]
+    #las cadenas pueden usar las demás opciones: {mes:02d}
+    scalars={k:v for k, v in options.items() if not isinstance(v, (list, dict))}
+    for name, value in options.items():
+        if name not in actions:
+            errors.append('opción desconocida {}{}'.format(name, suggestion(name, list(actions))))
+            continue
+        if isinstance(value, str) and '{' in value:
+            try:
+                value=value.format(**scalars)
+            except (KeyError, IndexError, ValueError) as err:
+                errors.append('{}: no se pudo sustituir {!r}: {}'.format(name, value, err))
+                continue
+        try:
+            setattr(args, name, convert(actions[name], value))
+        except JobError as err:
+            errors.append('{}: {}'.format(name, err))
+    #las opciones presentes pero inválidas ya se reportaron
+    errors+=missing_options(args, options)
+    errors+=option_errors(args)
+    return args, errors
+
+def option_errors(args):
+    '''
+    errores de combinaciones de opciones que argparse no revisa
+    '''
+    errors=[]
+    if args.compute_stat and args.backend!='xarray':
+        errors.append('compute_stat requiere backend: xarray (con netcdf se graficaría el primer tiempo)')
+    if args.compute_stat and args.tipo=='estacional':
+        errors.append('compute_stat no admite tipo: estacional')
+    return errors
+
+def missing_options(args, present=None):
+    '''
+    errores de las opciones obligatorias que faltan; present: nombres de las
+    opciones dadas (por omisión las que no son None en args)
+    '''
+    if present==None:
+        present=[name for name, value in vars(args).items() if value!=None]
+    errors=['falta la opción '+name for name in REQUIRED if name not in present]
+    if 'filename' not in present and 'xfilename' not in present:
+        errors.append('falta la opción filename (o xfilename)')
+    return errors
+
+def input_files(args):
+    '''
+    archivos de la sección y variables que deben contener
+    '''
+    if args.xcomp!=None and args.ycomp!=None:
+        xfilename=args.xfilename if args.xfilename!=None else args.filename
+        yfilename=args.yfilename if args.yfilename!=None else xfilename
+        return [(xfilename, args.xcomp), (yfilename, args.ycomp)]
+    var_name=args.var_alias if args.var_alias!=None else args.var_name
+    return [(args.filename, var_name)]
+
+def check_inputs(args, headers):
+    '''
+    errores de archivos, variables, coordenadas y niveles de la sección
+    headers: {ruta: (variables, eje de profundidad)} ya leídos
+    '''
+    errors=option_errors(args)
+    for filename, var_name in input_files(args):
+        if filename==None:
+            continue
+        path=filename
+        if args.backend=='xarray':
+            matches=sorted(glob.glob(filename))
+            if not matches:
+                errors.append('no hay archivos {}'.format(filename))
+                continue
+            path=matches[0]
+        if path not in headers:
+            import netCDF4 as nc
+            try:
+                with nc.Dataset(path, 'r') as root:
+                    zaxis=None
+                    if args.depth in root.variables:
+                        zaxis=np.ma.filled(root.variables[args.depth][:], np.nan)
+                    headers[path]=(set(root.variables), zaxis)
+            except OSError as err:
+                headers[path]=err
+        if isinstance(headers[path], OSError):
+            errors.append('no se puede abrir {}: {}'.format(path, headers[path]))
+            continue
+        variables, zaxis=headers[path]
+        for label, name in (('variable', var_name), ('lat', args.lat), ('long', args.long)):
+            if name not in variables:
+                errors.append('{} {!r} no existe en {}{}'.format(label, name, path,
+                    suggestion(name, sorted(variables))))
+        if args.level!=None:
+            if zaxis is None:
+                errors.append('depth {!r} no existe en {}{}'.format(args.depth, path,
+                    suggestion(args.depth, sorted(variables))))
+            else:
+                errors+=level_errors(args, zaxis, path)
+    return errors
+
+def level_errors(args, zaxis, path):
+    '''
+    errores de los niveles que find_level no encuentra en zaxis con level_method,
+    la misma búsqueda que hace la lectura
+    '''
+    missing=[]
+    errors=[]
+    for level in args.level:
+        try:
+            find_level(zaxis, level, args.level_method)
+        except ValueError as err:
+            missing.append(level)
+            if args.level_method!='exact':
+                errors.append('{}: {}'.format(path, err))
+    if missing and args.level_method=='exact':
+        errors.append('niveles {} no existen en {} (usar level_method: nearest o interp)'.format(
+            missing, path))
+    return errors
+
+def validate(args_list):
+    '''
+    errores de entrada de todas las secciones, con el nombre de la sección
+    '''
+    headers={}
+    errors=[]
+    for args in args_list:
+        errors+=['{}: {}'.format(args.var_name, error) for error in check_inputs(args, headers)]
+    return errors
+
+def load_jobs(path, parser, check_files=True):
+    '''
+    lista de Namespace de plot_fig, una por trabajo; JobError con todos los errores
+    '''
+    expanded=expand(read_file(path))
+    args_list=[]
+    errors=[]
+    headers={}
+    #las combinaciones de matrix repiten los errores del trabajo: uno por trabajo
+    seen=set()
+    for number, options in expanded:
+        args, job_errors=make_args(options, parser)
+        if not job_errors and check_files:
+            job_errors=check_inputs(args, headers)
+        label='trabajo {} ({})'.format(number, options.get('var_name', '?'))
+        for error in job_errors:
+            if (number, error) not in seen:
+                seen.add((number, error))
+                errors.append(label+': '+error)
+        args_list.append(args)
+    if errors:
+        raise JobError('Errores en {}:\n\t'.format(path)+'\n\t'.join(errors))
+    return args_list
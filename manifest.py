@@ -0,0 +1,107 @@
+'''
+manifiesto de figuras generadas para reconstrucción incremental
+por cada figura se guarda un hash de las opciones, fecha/tamaño del archivo
+de entrada y versiones de las bibliotecas; si nada cambió la figura se omite
+'''
+import os
+import glob
+import json
+import hashlib
+from importlib import metadata
+
+#cambiar cuando cambie la forma de dibujar las figuras para invalidar el manifiesto
+MANIFEST_VERSION=3
+
+#opciones que no cambian el contenido de la figura
+IGNORED_OPTIONS=['config_file','jobs','template','agg','force','no_manifest','profile','cprofile','figname',
+        'tile_jobs','cache_mb','background_save','chunks']
+
+#bibliotecas que intervienen en la figura
+LIBRARIES=['matplotlib', 'cartopy', 'netCDF4', 'numpy']
+
+_versions=None
+
+def library_versions():
+    '''
+    versiones de las bibliotecas que intervienen en la figura; se leen de los
+    metadatos instalados para no importar matplotlib y cartopy al planear
+    '''
+    global _versions
+    if _versions==None:
+        _versions={'manifest':MANIFEST_VERSION}
+        for name in LIBRARIES:
+            try:
+                _versions[name]=metadata.version(name)
+            except metadata.PackageNotFoundError:
+                module=__import__(name)
+                _versions[name]=module.__version__
+    return dict(_versions)
+
+def options_hash(args):
+    '''
+    hash de las opciones resueltas de la figura
+    '''
+    options={k:v for k,v in sorted(vars(args).items()) if k not in IGNORED_OPTIONS}
+    raw=json.dumps(options, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+def input_stat(filenames):
+    '''
+    fecha de modificación y tamaño de cada archivo de entrada
+    los patrones (--backend=xarray) se expanden a todos sus archivos
+    '''
+    stats=[]
+    for filename in filenames:
+        if filename==None:
+            continue
+        for path in sorted(glob.glob(filename)) or [filename]:
+            st=os.stat(path)
+            stats.append([os.path.abspath(path), st.st_mtime_ns, st.st_size])
+    return stats
+
+def fingerprint(args, versions=None):
+    '''
+    huella de una figura; None si no se puede calcular (p.ej. falta el archivo)
+    '''
+    try:
+        stats=input_stat([args.filename, args.xfilename, args.yfilename])
+    except OSError:
+        return None
+    return {'options':options_hash(args),
+            'input':stats,
+            'versions':versions if versions!=None else library_versions(),
+            }
+
+class Manifest:
+    '''
+    manifiesto JSON, por omisión en Figuras/.manifest.json
+    '''
+    def __init__(self, path='Figuras/.manifest.json'):
+        self.path=path
+        self.entries={}
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.entries=json.load(f)
+            except ValueError:
+                print('Manifiesto dañado, se ignora:', path)
+
+    def is_current(self, figpath, fprint=None):
+        '''
+        True si la figura existe y su huella coincide con la guardada
+        '''
+        if fprint==None or not os.path.exists(figpath):
+            return False
+        return self.entries.get(figpath)==fprint
+
+    def update(self, figpath, fprint):
+        self.entries[figpath]=fprint
+
+    def save(self):
+        dirname=os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        tmp=self.path+'.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
@@ -1,12 +1,19 @@
 import numpy as np
 import matplotlib
 import matplotlib.pyplot as plt 
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from contextlib import contextmanager
 import cartopy.crs as ccrs
 import cartopy.feature as cfeature
 from cartopy.mpl.gridliner import LONGITUDE_FORMATTER, LATITUDE_FORMATTER
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 import matplotlib.colors as colors
+from matplotlib.collections import QuadMesh
 import textwrap
+from geom_cache import cached_feature, BATHY_LAYERS
+from timing import span, timed_artist
+from nc_reader import extent_window
 
 def map_pcolor(loncoords, latcoords, zvar, title='',
                                            colorbar_label='', 
@@ -20,7 +27,10 @@ def map_pcolor(loncoords, latcoords, zvar, title='',
                                            vmax=None,
                                            norm=None,
                                            colorbar_orientation='horizontal',
-                                           crs=ccrs.PlateCarree()):
+                                           crs=ccrs.PlateCarree(),
+                                           pyplot=True,
+                                           max_cells=None,
+                                           decimate_method='mean'):
     """
        -
        Crea un gráfico tipo pcolormesh sobre un mapa, agrega linea de costas, lineas 
@@ -57,18 +67,32 @@ def map_pcolor(loncoords, latcoords, zvar, title='',
         colorbar_orientation - Orientación de la barra de color
         crs                  - Proyección, ver 
                                https://scitools.org.uk/cartopy/docs/v0.15/crs/projections.html
+        pyplot               - Si es False la figura no se registra en pyplot y se dibuja
+                               directamente con Agg, no es necesario cerrarla
+        max_cells            - Número máximo de celdas por eje. Si la malla es mayor se recorta
+                               a extent y se reduce por bloques antes del pcolormesh (ver
+                               decimate_grid). Ej. 1600 para 8 pulgadas a 200 dpi
+        decimate_method      - Reducción de cada bloque: 'mean' o 'max'
 
 
         La función regresa el eje matplotlib del grafico y la figura.
     """
 
     # Global
-    global_plot_params()
-    fig, ax = start_plot(crs)
+    with span('start_plot'):
+        global_plot_params()
+        fig, ax = start_plot(crs, pyplot)
     
-    plt.title("\n".join(textwrap.wrap(title,50)), pad=20, fontsize=16)
+    ax.set_title("\n".join(textwrap.wrap(title,50)), pad=20, fontsize=16)
 
-    colormeshObj = ax.pcolormesh(loncoords, latcoords, np.squeeze(zvar), cmap=plt.get_cmap(cmap), norm=norm, vmin=vmin, vmax=vmax)
+    if max_cells is not None:
+        with span('decimate'):
+            loncoords, latcoords, zvar = decimate_grid(loncoords, latcoords, zvar, max_cells,
+                                                       method=decimate_method, extent=extent)
+
+    with span('pcolormesh'):
+        colormeshObj = ax.pcolormesh(loncoords, latcoords, np.squeeze(zvar), cmap=plt.get_cmap(cmap), norm=norm, vmin=vmin, vmax=vmax)
+    timed_artist(colormeshObj, 'draw_pcolormesh')
 
     # Colorbar
     # Las siguientes dos lineas se encargan de agregar un eje del lado derecho de la figura
@@ -76,25 +100,27 @@ def map_pcolor(loncoords, latcoords, zvar, title='',
     # Con este metodo aseguramos que la barra de color vertical sea de la misma altura que el
     # plot de pcolormesh
     # Ref: https://stackoverflow.com/questions/18195758/set-matplotlib-colorbar-size-to-match-graph
-    if colorbar_orientation == 'vertical':
-        divider = make_axes_locatable(ax)
-        cax = divider.append_axes("right", size="5%", pad=0.08, axes_class=matplotlib.pyplot.Axes)    
-        plt.colorbar(colormeshObj, label=colorbar_label, cax=cax)
-    else:
-        plt.colorbar(colormeshObj, label=colorbar_label, orientation='horizontal', pad=0.08)
+    with span('colorbar'):
+        if colorbar_orientation == 'vertical':
+            divider = make_axes_locatable(ax)
+            cax = divider.append_axes("right", size="5%", pad=0.08, axes_class=matplotlib.pyplot.Axes)    
+            fig.colorbar(colormeshObj, label=colorbar_label, cax=cax)
+        else:
+            fig.colorbar(colormeshObj, label=colorbar_label, orientation='horizontal', pad=0.08)
 
     #    
-    addCoastlines(ax, plot_land, land_dataset)
-    addBathy(ax, plot_bathy)
-    addCoordinateTicks(ax, loncoords, latcoords, tickBins)
+    if extent is None:
+        extent = [loncoords.min(), loncoords.max(), latcoords.min(), latcoords.max()]
+    with span('coastlines'):
+        addCoastlines(ax, plot_land, land_dataset, extent=extent)
+    with span('bathy'):
+        addBathy(ax, plot_bathy, extent=extent)
+    with span('ticks'):
+        addCoordinateTicks(ax, loncoords, latcoords, tickBins)
 
     #
-    if extent is None:
-        ax.set_extent([loncoords.min(), loncoords.max(), latcoords.min(), latcoords.max()], crs=crs)
-    else:
-        ax.set_extent(extent, crs=crs)
+    ax.set_extent(extent, crs=crs)
     #
-    fig = matplotlib.pyplot.gcf()
     fig.set_size_inches(8,8) 
     return ax, fig
 
@@ -103,6 +129,7 @@ def map_pcolor(loncoords, latcoords, zvar, title='',
 def map_quiver(loncoords, latcoords, uvar, vvar,
                                            title='',
                                            slice_interval=8,
+                                           arrow_density=None,
                                            quiverkeysize=None,
                                            quiverkeyunits='ms$^{-1}$)',
                                            quiverkeyposition={ 'x' : 0.55, 'y': -0.08},
@@ -111,7 +138,8 @@ def map_quiver(loncoords, latcoords, uvar, vvar,
                                            land_dataset='GSHHS', 
                                            tickBins=4,
                                            extent=None,
-                                           crs=ccrs.PlateCarree()):
+                                           crs=ccrs.PlateCarree(),
+                                           pyplot=True):
     """
        - 
        Crea un gráfico tipo quiver y quiverkey sobre un mapa, agrega linea de costas, lineas 
@@ -133,6 +161,7 @@ def map_quiver(loncoords, latcoords, uvar, vvar,
         title             - Titulo del plot
         slice_interval    - Número de puntos de malla a omitir en el graficado de vectores 
                             de dirección
+        arrow_density     - Flechas por pulgada; si se indica reemplaza a slice_interval
         quiverkeysize     - Tamaño del vector de referencia que se usa en quiverkey
         quiverkeyunits    - Etiqueta para el vector de referencia
         quiverkeyposition - Diccionario con llaves 'x' y 'y' con la posición del vector
@@ -149,38 +178,45 @@ def map_quiver(loncoords, latcoords, uvar, vvar,
                             [lonmin, lonmax, latmin, latmax]
         crs               - Proyección, ver 
                             https://scitools.org.uk/cartopy/docs/v0.15/crs/projections.html
+        pyplot            - Si es False la figura no se registra en pyplot y se dibuja
+                            directamente con Agg, no es necesario cerrarla
     """                                           
         
     # Global
-    global_plot_params()
-    fig, ax = start_plot(crs)
+    with span('start_plot'):
+        global_plot_params()
+        fig, ax = start_plot(crs, pyplot)
     #
 
-    plt.title("\n".join(textwrap.wrap(title,50)), pad=20, fontsize=16)
+    ax.set_title("\n".join(textwrap.wrap(title,50)), pad=20, fontsize=16)
 
     # Contenido grafico
-    add_quiverPlot(ax, loncoords, latcoords, uvar, vvar, crs, 
+    with span('quiver'):
+        add_quiverPlot(ax, loncoords, latcoords, uvar, vvar, crs, 
                                                          slice_interval=slice_interval, 
                                                          quiverkeysize=quiverkeysize, 
                                                          quiverkeyunits=quiverkeyunits,
-                                                         quiverkeyposition=quiverkeyposition)
-    addCoastlines(ax, plot_land, land_dataset)
-    addBathy(ax, plot_bathy)
-    addCoordinateTicks(ax, loncoords, latcoords, tickBins, crs=crs)
+                                                         quiverkeyposition=quiverkeyposition,
+                                                         arrow_density=arrow_density,
+                                                         extent=extent)
+    if extent is None:
+        extent = [loncoords.min(), loncoords.max(), latcoords.min(), latcoords.max()]
+    with span('coastlines'):
+        addCoastlines(ax, plot_land, land_dataset, extent=extent)
+    with span('bathy'):
+        addBathy(ax, plot_bathy, extent=extent)
+    with span('ticks'):
+        addCoordinateTicks(ax, loncoords, latcoords, tickBins, crs=crs)
 
     # 
-    if extent is None:
-        ax.set_extent([loncoords.min(), loncoords.max(), latcoords.min(), latcoords.max()], crs=crs)
-    else:
-        ax.set_extent(extent, crs=crs)    
+    ax.set_extent(extent, crs=crs)    
 
     #
-    fig = matplotlib.pyplot.gcf()
     fig.set_size_inches(8,8)    
     return ax, fig
 
 
-def add_quiverPlot(ax, xx, yy, u, v, crs=ccrs.PlateCarree(), slice_interval=(8,8), quiverkeysize=None, quiverkeyunits='ms$^{-1}$)', quiverkeyposition={ 'x' : 0.55, 'y': -0.08}):
+def add_quiverPlot(ax, xx, yy, u, v, crs=ccrs.PlateCarree(), slice_interval=(8,8), quiverkeysize=None, quiverkeyunits='ms$^{-1}$)', quiverkeyposition={ 'x' : 0.55, 'y': -0.08}, arrow_density=None, extent=None, quiverkeylabelpos='S', scale=None, quiverkey=True):
     """
      Agrega un grafico tipo quiver y quiverkey al eje 'ax'
 
@@ -188,91 +224,473 @@ def add_quiverPlot(ax, xx, yy, u, v, crs=ccrs.PlateCarree(), slice_interval=(8,8
        ax   - eje del grafico matplotlib
        xx   - Arreglo ndarray 1D o 2D con variable de coordenadas longitud
        yy   - Arreglo ndarray 1D o 2D con variable de coordenadas latitud
-       u    - Arreglo ndarray 2D con el los componentes U del mapa de vectores
-       v    - Arreglo ndarray 2D con el los componentes V del mapa de vectores
+       u    - Arreglo ndarray 2D (lat, lon) con el los componentes U del mapa de vectores
+       v    - Arreglo ndarray 2D (lat, lon) con el los componentes V del mapa de vectores
+              Pueden ser masked arrays; los puntos enmascarados (tierra) no se dibujan
 
       Parametros opcionales:
        crs  - Proyección, ver 
               https://scitools.org.uk/cartopy/docs/v0.15/crs/projections.html
        slice_interval    - Factor, o tuple 2D con elementos omitidos del mapa de vectores.
                            skipxy, o (skipx, skipy)
-       quiverkeysize     - Tamano del vector de referencia,
+       quiverkeysize     - Tamano del vector de referencia, si es None se calcula con
+                           la rapidez de los vectores dibujados
        quiverkeyunits    - Leyenda para unidades  
        quiverkeyposition - Diccionario con llaves 'x' y 'y' con la posición del vector
                             de referencia
+       quiverkeylabelpos - Posición de la leyenda respecto al vector de referencia
+                           ('N', 'S', 'E' o 'W')
+       scale             - Rapidez por pulgada de flecha; con el mismo valor las flechas de
+                           varios ejes son comparables. Si es None matplotlib la calcula
+       quiverkey         - Si es False no se dibuja el vector de referencia
+
+      Regresa el objeto Quiver.
+       arrow_density     - Flechas por pulgada del eje. Si se indica, el salto se calcula
+                           con el tamaño del eje y el número de puntos en extent, en lugar
+                           de slice_interval
+       extent            - [lonmin, lonmax, latmin, latmax], solo se usan los puntos
+                           dentro del dominio
     """
+    # Solo la ventana de extent; los slices son vistas, no copian los arreglos
+    if extent is not None:
+        slat, slon = extent_window(xx, yy, extent)
+        if xx.ndim == 2:
+            xx, yy = xx[slat, slon], yy[slat, slon]
+        else:
+            xx, yy = xx[slon], yy[slat]
+        u, v = u[slat, slon], v[slat, slon]
+
     # El slice skip sirve para reducir el numero de flechas de vectores que se muestran en el plot
     # omitiendo elementos con un salto del factor 'slice_interval'
     # Este numero puede variar dependiendo de la resolución de las variables uvar, vvar
+    if arrow_density is not None:
+        slice_interval = quiver_stride(ax, u.shape, arrow_density)
     if isinstance(slice_interval, tuple):
         skipx = slice(None, None, slice_interval[0])
         skipy = slice(None, None, slice_interval[1])
     else:
         skipx = skipy = slice(None, None, slice_interval)
 
+    # Los arreglos 2D son (lat, lon): el salto en y va en el primer eje
     if xx.ndim == 2:
-        xxskiped = xx[skipx, skipy]
-        yyskiped = yy[skipx, skipy]
+        xxskiped = xx[skipy, skipx]
+        yyskiped = yy[skipy, skipx]
     else:
         xxskiped = xx[skipx]
         yyskiped = yy[skipy]
+    uskiped = np.ma.masked_invalid(u[skipy, skipx])
+    vskiped = np.ma.masked_invalid(v[skipy, skipx])
 
-    quiverObj = ax.quiver(xxskiped, yyskiped, u[skipx,skipy], v[skipx,skipy], transform=crs)
+    if scale is None:
+        quiverObj = ax.quiver(xxskiped, yyskiped, uskiped, vskiped, transform=crs)
+    else:
+        quiverObj = ax.quiver(xxskiped, yyskiped, uskiped, vskiped, transform=crs,
+                              scale=scale, scale_units='inches')
+    timed_artist(quiverObj, 'draw_quiver')
+    if not quiverkey:
+        return quiverObj
 
-    # Calcular el tamano de quiverkey
+    # Calcular el tamano de quiverkey con los vectores dibujados
     if quiverkeysize is None:
-        speed = np.sqrt(np.power(u,2) + np.power(v,2))
-        quiverkeysize = np.round(np.nanmax(speed))/2.0
+        quiverkeysize = quiverkey_size(max_speed(uskiped, vskiped))
 
-    plt.quiverkey(quiverObj, quiverkeyposition['x'], quiverkeyposition['y'], quiverkeysize, '(' + str(quiverkeysize) + ' ' + quiverkeyunits,
-                   labelpos='S',
+    ax.quiverkey(quiverObj, quiverkeyposition['x'], quiverkeyposition['y'], quiverkeysize, '(' + str(quiverkeysize) + ' ' + quiverkeyunits,
+                   labelpos=quiverkeylabelpos,
                    transform=crs,
                    color='black',
                    fontproperties={'size':13})
+    return quiverObj
+
+def max_speed(u, v):
+    """
+     Rapidez máxima de los vectores válidos (0 si no hay)
+    """
+    speed = np.ma.sqrt(np.ma.masked_invalid(u)**2 + np.ma.masked_invalid(v)**2)
+    return float(speed.max()) if speed.count() > 0 else 0.0
+
+def quiverkey_size(maxspeed):
+    """
+     Tamaño del vector de referencia: la mitad de la rapidez máxima redondeada
+    """
+    size = np.round(maxspeed)/2.0
+    if size == 0 and maxspeed > 0:
+        # Corrientes débiles: mitad del máximo con una cifra significativa
+        size = float('{:.1g}'.format(maxspeed/2.0))
+    return size
+
+
+# Plantillas
+class MapTemplate:
+    """
+       Mapa base reutilizable para series de figuras con el mismo dominio, malla y
+       proyección. Se construye con map_pcolor: figura, GeoAxes, costas, batimetría,
+       marcadores y barra de color se dibujan una sola vez. En cada figura solo se
+       actualiza el arreglo del pcolormesh, los límites de la barra de color, el
+       título y la anotación.
+
+       Recibe los mismos parametros que map_pcolor. Por omisión la figura no se registra
+       en pyplot (pyplot=False); puede usarse como contexto para cerrarla al terminar.
+
+       Ej:
+        template = MapTemplate(lon, lat, var_ene, title='Enero', vmin=20, vmax=32)
+        template.save('enero.png')
+        template.update(var_feb, title='Febrero', annotation='Febrero')
+        template.save('febrero.png')
+    """
+
+    def __init__(self, loncoords, latcoords, zvar, title='', **kwargs):
+        kwargs.setdefault('pyplot', False)
+        self.ax, self.fig = map_pcolor(loncoords, latcoords, zvar, title=title, **kwargs)
+        # El pcolormesh es la unica QuadMesh del eje
+        self.colormesh = [c for c in self.ax.collections if isinstance(c, QuadMesh)][0]
+        self.shape = np.shape(np.squeeze(zvar))
+        # Con max_cells cada arreglo nuevo se reduce igual que el primero
+        self.grid = (loncoords, latcoords)
+        self.decimate = None
+        if kwargs.get('max_cells') is not None:
+            self.decimate = dict(max_cells=kwargs['max_cells'],
+                                 method=kwargs.get('decimate_method', 'mean'),
+                                 extent=kwargs.get('extent'))
+        self.fixed_clim = kwargs.get('norm') is not None
+        self.annotation = None
+
+    def update(self, zvar, title=None, vmin=None, vmax=None, annotation=None):
+        """
+         Reemplaza los datos del mapa.
+          zvar       - Arreglo ndarray 2D con la misma forma que la malla de la plantilla
+          title      - Titulo del plot, None conserva el anterior
+          vmin, vmax - Límites de la barra de color, si son None se ajustan a los datos
+          annotation - Texto en la esquina superior izquierda, None lo oculta
+        """
+        zvar = np.squeeze(zvar)
+        if zvar.shape != self.shape:
+            raise ValueError('La malla {} no coincide con la plantilla {}'.format(zvar.shape, self.shape))
+        if self.decimate is not None:
+            with span('decimate'):
+                zvar = decimate_grid(self.grid[0], self.grid[1], zvar, **self.decimate)[2]
+        self.colormesh.set_array(zvar)
+        if not self.fixed_clim:
+            if vmin is None or vmax is None:
+                self.colormesh.autoscale()
+            self.colormesh.set_clim(vmin, vmax)
+        if title is not None:
+            self.ax.set_title("\n".join(textwrap.wrap(title,50)), pad=20, fontsize=16)
+        self.annotate(annotation)
+
+    def annotate(self, text, xy=(0.02,0.94)):
+        """
+         Agrega, cambia u oculta (text=None) la anotación del mapa
+        """
+        if self.annotation is None:
+            if text is None:
+                return
+            self.annotation = self.ax.annotate(text, xy=xy, xycoords='axes fraction')
+        else:
+            self.annotation.set_text(text if text is not None else '')
+
+    def save(self, path, **kwargs):
+        """
+         Guarda la figura, por omisión con bbox_inches='tight' y dpi=200
+        """
+        kwargs.setdefault('bbox_inches', 'tight')
+        kwargs.setdefault('dpi', 200)
+        self.fig.savefig(path, **kwargs)
+
+    def close(self):
+        close_figure(self.fig)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Paneles
+def map_panels(panels, nrows, ncols, title='',
+                                     colorbar_label='',
+                                     cmap='viridis',
+                                     plot_land=True,
+                                     plot_bathy=True,
+                                     land_dataset='GSHHS',
+                                     tickBins=4,
+                                     extent=None,
+                                     vmin=None,
+                                     vmax=None,
+                                     norm=None,
+                                     crs=ccrs.PlateCarree(),
+                                     pyplot=True,
+                                     max_cells=None,
+                                     decimate_method='mean',
+                                     arrow_density=None,
+                                     quiverkeyunits='ms$^{-1}$)',
+                                     panel_size=4):
+    """
+       -
+       Crea una figura con nrows x ncols mapas tipo pcolormesh (y vectores opcionales)
+       con una barra de color compartida. Las costas y batimetría de cada panel se
+       toman del cache de geom_cache, por lo que solo se leen una vez.
 
+       Parametros requeridos:
+        panels               - Lista de diccionarios, uno por panel, con llaves:
+                               'lon', 'lat' - Coordenadas 1D o 2D
+                               'z'          - Arreglo 2D a graficar
+                               'title'      - (opcional) Titulo del panel
+                               'u', 'v'     - (opcional) Componentes de vectores
+        nrows, ncols         - Número de renglones y columnas
+
+       Parametros opcionales:
+        title                - Titulo general de la figura
+        vmin, vmax           - Límites de la barra de color; si son None se usan el mínimo y
+                               máximo de todos los paneles
+        panel_size           - Tamaño de cada panel en pulgadas
+        arrow_density        - Flechas por pulgada en los paneles con vectores; todos los
+                               paneles usan la misma escala de flechas y un solo vector de
+                               referencia, arriba a la derecha del último panel del primer renglón
+        quiverkeyunits       - Leyenda para unidades del vector de referencia
+        El resto de los parametros son los de map_pcolor.
+
+        La función regresa la lista de ejes y la figura.
+    """
+    if len(panels) > nrows*ncols:
+        raise ValueError('{} paneles no caben en {}x{}'.format(len(panels), nrows, ncols))
+    if norm is None and (vmin is None or vmax is None):
+        zmin = min(float(np.ma.min(p['z'])) for p in panels)
+        zmax = max(float(np.ma.max(p['z'])) for p in panels)
+        vmin = zmin if vmin is None else vmin
+        vmax = zmax if vmax is None else vmax
+
+    # Alto de cada panel según la proporción del dominio, más espacio para títulos
+    bounds = extent
+    if bounds is None:
+        bounds = [np.min(panels[0]['lon']), np.max(panels[0]['lon']),
+                  np.min(panels[0]['lat']), np.max(panels[0]['lat'])]
+    aspect = float(bounds[3]-bounds[2])/float(bounds[1]-bounds[0])
+    figsize = (ncols*panel_size, nrows*(panel_size*aspect+0.6)+1.5)
+    with span('start_plot'):
+        global_plot_params()
+        if pyplot:
+            fig = plt.figure(figsize=figsize, layout='constrained')
+        else:
+            fig = Figure(figsize=figsize, layout='constrained')
+            FigureCanvasAgg(fig)
+    fig.suptitle("\n".join(textwrap.wrap(title, 25*ncols)), fontsize=18)
+
+    # Misma escala de flechas en todos los paneles: la rapidez máxima mide
+    # la separación entre flechas (1/arrow_density pulgadas)
+    if arrow_density is None:
+        arrow_density = 2
+    vector_panels = [p for p in panels if 'u' in p and 'v' in p]
+    maxspeed = max([max_speed(p['u'], p['v']) for p in vector_panels] or [0.0])
+    quiverscale = maxspeed*arrow_density if maxspeed > 0 else None
+    key_panel = min(ncols, len(panels))-1
+
+    axes = []
+    for i, panel in enumerate(panels):
+        ax = fig.add_subplot(nrows, ncols, i+1, projection=crs)
+        axes.append(ax)
+        loncoords, latcoords, zvar = panel['lon'], panel['lat'], panel['z']
+        ax.set_title(panel.get('title', ''), fontsize=14)
+        if max_cells is not None:
+            with span('decimate'):
+                loncoords, latcoords, zvar = decimate_grid(loncoords, latcoords, zvar, max_cells,
+                                                           method=decimate_method, extent=extent)
+        with span('pcolormesh'):
+            colormeshObj = ax.pcolormesh(loncoords, latcoords, np.squeeze(zvar), cmap=plt.get_cmap(cmap), norm=norm, vmin=vmin, vmax=vmax)
+        timed_artist(colormeshObj, 'draw_pcolormesh')
+        if 'u' in panel and 'v' in panel:
+            with span('quiver'):
+                # Un solo vector de referencia, fuera del mapa para no tapar títulos ni marcas
+                add_quiverPlot(ax, panel['lon'], panel['lat'], panel['u'], panel['v'], crs,
+                               arrow_density=arrow_density,
+                               extent=extent,
+                               scale=quiverscale,
+                               quiverkey=(i == key_panel),
+                               quiverkeysize=quiverkey_size(maxspeed),
+                               quiverkeyunits=quiverkeyunits,
+                               quiverkeyposition={'x':0.92, 'y':1.05},
+                               quiverkeylabelpos='W')
+        panel_extent = extent
+        if panel_extent is None:
+            panel_extent = [loncoords.min(), loncoords.max(), latcoords.min(), latcoords.max()]
+        with span('coastlines'):
+            addCoastlines(ax, plot_land, land_dataset, extent=panel_extent)
+        with span('bathy'):
+            addBathy(ax, plot_bathy, extent=panel_extent)
+        with span('ticks'):
+            # addCoordinateTicks modifica el diccionario de marcadores
+            addCoordinateTicks(ax, loncoords, latcoords, dict(tickBins) if isinstance(tickBins, dict) else tickBins, crs=crs)
+            # Etiquetas solo en la columna izquierda y el renglón inferior
+            ax.tick_params(labelleft=(i % ncols == 0), labelbottom=(i+ncols >= len(panels)), labelsize=11)
+        ax.set_extent(panel_extent, crs=crs)
+
+    with span('colorbar'):
+        fig.colorbar(colormeshObj, ax=axes, label=colorbar_label, orientation='horizontal',
+                     fraction=0.04, pad=0.08, aspect=40)
+    return axes, fig
+
+def quiver_stride(ax, shape, arrow_density):
+    """
+     Salto (skipx, skipy) para dibujar arrow_density flechas por pulgada en el eje ax
+     con una malla de forma shape=(ny, nx)
+    """
+    fig = ax.get_figure()
+    width, height = fig.get_size_inches()
+    bbox = ax.get_position()
+    ny, nx = shape[-2], shape[-1]
+    skipx = max(1, int(round(nx / max(bbox.width * width * arrow_density, 1))))
+    skipy = max(1, int(round(ny / max(bbox.height * height * arrow_density, 1))))
+    return (skipx, skipy)
 
 def global_plot_params():
     matplotlib.rcParams['font.family'] = "serif"
     matplotlib.rcParams['font.size'] = 16
 
-def start_plot(crs):
-    fig = plt.figure(figsize=(8, 8))
-    ax = plt.subplot(111, projection=crs)
+def start_plot(crs, pyplot=True):
+    if pyplot:
+        fig = plt.figure(figsize=(8, 8))
+        ax = plt.subplot(111, projection=crs)
+    else:
+        # Figura fuera de pyplot: se libera en cuanto no hay referencias a ella
+        fig = Figure(figsize=(8, 8))
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(111, projection=crs)
     #plt.tight_layout(pad=2)
     return fig, ax
 
+def close_figure(fig=None):
+    """
+     Cierra la figura en pyplot (o todas si fig es None) para liberar su memoria.
+     Las figuras creadas con pyplot=False no estan registradas y no requieren cerrarse.
+    """
+    if fig is None:
+        plt.close('all')
+    elif plt.fignum_exists(getattr(fig, 'number', None)):
+        plt.close(fig)
+
+@contextmanager
+def managed_figure(fig):
+    """
+     Contexto que cierra la figura al salir, aun si ocurre un error.
+     Ej:
+      ax, fig = map_pcolor(lon, lat, var)
+      with managed_figure(fig):
+          fig.savefig('figura.png')
+    """
+    try:
+        yield fig
+    finally:
+        close_figure(fig)
+
 # Utils
 
-def addCoastlines(ax, plot_land=True, land_dataset='GSHHS'):
+def decimate_grid(loncoords, latcoords, zvar, max_cells, method='mean', extent=None, min_valid=0.5):
+    """
+     Recorta la malla a extent y la reduce por bloques para que no tenga más de max_cells
+     celdas por eje; las celdas menores a un pixel no aportan a la imagen.
+
+      loncoords, latcoords - Coordenadas 1D o 2D (lat, lon) de los centros de celda
+      zvar                 - Arreglo 2D (puede ser masked array o tener NaN)
+      max_cells            - Entero o tuple (ny, nx) con el máximo de celdas por eje
+      method               - 'mean' o 'max' de los valores válidos de cada bloque
+      extent               - [lonmin, lonmax, latmin, latmax] para recortar antes de reducir
+      min_valid            - Fracción mínima de celdas válidas para que el bloque no quede
+                             enmascarado; conserva la máscara de tierra
+
+     Regresa lon, lat y zvar reducidos (las coordenadas son el promedio de cada bloque).
+    """
+    loncoords = np.asarray(loncoords)
+    latcoords = np.asarray(latcoords)
+    zvar = np.ma.masked_invalid(np.squeeze(zvar))
+    if extent is not None:
+        slat, slon = extent_window(loncoords, latcoords, extent)
+        zvar = zvar[slat, slon]
+        if loncoords.ndim == 1:
+            loncoords, latcoords = loncoords[slon], latcoords[slat]
+        else:
+            loncoords, latcoords = loncoords[slat, slon], latcoords[slat, slon]
+    ny, nx = zvar.shape
+    maxy, maxx = max_cells if isinstance(max_cells, tuple) else (max_cells, max_cells)
+    fy, fx = -(-ny // maxy), -(-nx // maxx)
+    if fy == 1 and fx == 1:
+        return loncoords, latcoords, zvar
+    zvar = block_reduce(zvar, (fy, fx), method, min_valid)
+    if loncoords.ndim == 1:
+        loncoords = block_reduce(loncoords[np.newaxis, :], (1, fx))[0]
+        latcoords = block_reduce(latcoords[np.newaxis, :], (1, fy))[0]
+    else:
+        loncoords = block_reduce(loncoords, (fy, fx))
+        latcoords = block_reduce(latcoords, (fy, fx))
+    return np.ma.getdata(loncoords), np.ma.getdata(latcoords), zvar
+
+def block_reduce(zvar, factors, method='mean', min_valid=0.5):
+    """
+     Reduce el arreglo 2D zvar por bloques de factors=(fy, fx) celdas. Los bloques del borde
+     pueden ser incompletos. Un bloque queda enmascarado si tiene menos de min_valid
+     (fracción) de celdas válidas.
+    """
+    fy, fx = factors
+    zvar = np.ma.masked_invalid(zvar)
+    ny, nx = zvar.shape
+    my, mx = -(-ny // fy), -(-nx // fx)
+    padded = np.ma.masked_all((my*fy, mx*fx), dtype=float)
+    padded[:ny, :nx] = zvar
+    blocks = padded.reshape(my, fy, mx, fx)
+    if method == 'max':
+        reduced = blocks.max(axis=(1, 3))
+    elif method == 'mean':
+        reduced = blocks.mean(axis=(1, 3))
+    else:
+        raise ValueError('Método de reducción desconocido: ' + str(method))
+    # celdas reales (sin relleno) y válidas de cada bloque
+    inside = np.zeros((my*fy, mx*fx), dtype=bool)
+    inside[:ny, :nx] = True
+    total = inside.reshape(my, fy, mx, fx).sum(axis=(1, 3))
+    valid = (~np.ma.getmaskarray(blocks)).sum(axis=(1, 3))
+    return np.ma.masked_where(valid < min_valid*total, reduced)
+
+
+def addCoastlines(ax, plot_land=True, land_dataset='GSHHS', extent=None):
     """
      Agrega lineas de costas y poligonos de tierra, al grafico de cartopy. Los datos son consultados de los 
      datasets que hospedan NaturalEarth o GSHHS, este ultimo teniendo los poligonos de costa con mas 
      resolución. 
+     Si se indica extent [lonmin, lonmax, latmin, latmax] las geometrías se toman del cache
+     de geom_cache, ya recortadas y proyectadas a la proyección del eje.
      Nota: La primera vez que se solicita agregar lineas de costa puede tomar algunos minutos
            pues hace la descarga de los datasets mundiales.
     """
     # CFeature Coastlines, and land HighRes
     if plot_land:
         if land_dataset=='GSHHS':
-            ax.add_feature(cfeature.GSHHSFeature(scale='full', levels=[1], linewidth=0.25, edgecolor='black', facecolor='lightgray') )
+            style = dict(linewidth=0.25, edgecolor='black', facecolor='lightgray')
+            if extent is None:
+                timed_artist(ax.add_feature(cfeature.GSHHSFeature(scale='full', levels=[1], **style) ), 'draw_coastlines')
+            else:
+                timed_artist(ax.add_feature(cached_feature('GSHHS', 1, 'full', extent, ax.projection, **style)), 'draw_coastlines')
         elif land_dataset=='NaturalEarth':
-            ax.add_feature(cfeature.NaturalEarthFeature('physical', 'land', '10m', edgecolor='face', facecolor='lightgray'))
+            style = dict(edgecolor='face', facecolor='lightgray')
+            if extent is None:
+                timed_artist(ax.add_feature(cfeature.NaturalEarthFeature('physical', 'land', '10m', **style)), 'draw_coastlines')
+            else:
+                timed_artist(ax.add_feature(cached_feature('NaturalEarth', 'land', '10m', extent, ax.projection, **style)), 'draw_coastlines')
         else:
             ax.coastlines(resolution='10m', color='black', linewidth=0.5)
 
-def addBathy(ax, plot_bathy=True):
+def addBathy(ax, plot_bathy=True, extent=None):
     """
      Agrega lineas batimetricas al grafico de cartopy. Los datos son consultados
      de los datasets batimetricos que hospeda NaturalEarth https://www.naturalearthdata.com/downloads/10m-physical-vectors/10m-bathymetry/
+     Si se indica extent las geometrías se toman del cache de geom_cache.
     """
     # Bathy
     if plot_bathy:
-        ax.add_feature(cfeature.NaturalEarthFeature(name='bathymetry_K_200',  scale='10m', category='physical',linewidth=0.5, edgecolor='gray', facecolor='None', label='etiqueta'))
-        ax.add_feature(cfeature.NaturalEarthFeature(name='bathymetry_J_1000', scale='10m', category='physical',linewidth=0.5, edgecolor='gray', facecolor='None', label='etiqueta'))
-        ax.add_feature(cfeature.NaturalEarthFeature(name='bathymetry_I_2000', scale='10m', category='physical',linewidth=0.5, edgecolor='gray', facecolor='None', label='etiqueta'))
-        ax.add_feature(cfeature.NaturalEarthFeature(name='bathymetry_H_3000', scale='10m', category='physical',linewidth=0.5, edgecolor='gray', facecolor='None', label='etiqueta'))
-        ax.add_feature(cfeature.NaturalEarthFeature(name='bathymetry_G_4000', scale='10m', category='physical',linewidth=0.5, edgecolor='gray', facecolor='None', label='etiqueta'))
-        ax.add_feature(cfeature.NaturalEarthFeature(name='bathymetry_F_5000', scale='10m', category='physical',linewidth=0.5, edgecolor='gray', facecolor='None', label='etiqueta'))
+        style = dict(linewidth=0.5, edgecolor='gray', facecolor='None', label='etiqueta')
+        for name in BATHY_LAYERS:
+            if extent is None:
+                timed_artist(ax.add_feature(cfeature.NaturalEarthFeature(name=name, scale='10m', category='physical', **style)), 'draw_bathy')
+            else:
+                timed_artist(ax.add_feature(cached_feature('NaturalEarth', name, '10m', extent, ax.projection, **style)), 'draw_bathy')
 
 def addCoordinateTicks(ax, loncoords, latcoords, tickBins=4, decimals=1, crs=ccrs.PlateCarree()):
     """
@@ -0,0 +1,265 @@
+'''
+lectura de rebanadas (hyperslabs) de archivos NetCDF
+solo se leen del disco el tiempo, nivel y ventana lat/lon que usa la figura
+'''
+import os
+from collections import OrderedDict
+import numpy as np
+
+def find_level(z, level, method='exact'):
+    '''
+    busca el nivel en el eje de profundidad z
+    regresa lista de pares (índice, peso) y la profundidad encontrada
+    method:
+        exact   - el nivel debe existir en la malla
+        nearest - el nivel más cercano
+        interp  - interpolación lineal entre los dos niveles vecinos
+    '''
+    z=np.ma.filled(np.asarray(z, dtype=float), np.nan)
+    exact=np.argwhere(z==level)
+    if len(exact)>0:
+        i=int(exact[0][0])
+        return [(i, 1.0)], float(z[i])
+    if method=='exact':
+        raise ValueError('No existe el nivel {} m en la malla: {}'.format(level, z))
+    if method=='nearest':
+        i=int(np.nanargmin(np.abs(z-level)))
+        return [(i, 1.0)], float(z[i])
+    if method=='interp':
+        order=np.argsort(z)
+        zs=z[order]
+        if level<zs[0] or level>zs[-1]:
+            raise ValueError('El nivel {} m está fuera de la malla [{}, {}]'.format(
+                level, zs[0], zs[-1]))
+        k=int(np.searchsorted(zs, level))
+        i0, i1=int(order[k-1]), int(order[k])
+        w=(level-z[i0])/(z[i1]-z[i0])
+        return [(i0, 1.0-w), (i1, w)], float(level)
+    raise ValueError('Método de búsqueda de nivel desconocido: '+str(method))
+
+def extent_window(lon, lat, extent):
+    '''
+    regresa los slices (ilat, ilon) que cubren extent=[lonmin, lonmax, latmin, latmax]
+    acepta coordenadas 1D o 2D (lat, lon); se agrega un punto de margen
+    '''
+    lonmin, lonmax, latmin, latmax=extent
+    if lon.ndim==1:
+        ilon=np.flatnonzero((lon>=lonmin)&(lon<=lonmax))
+        ilat=np.flatnonzero((lat>=latmin)&(lat<=latmax))
+    else:
+        inside=(lon>=lonmin)&(lon<=lonmax)&(lat>=latmin)&(lat<=latmax)
+        ilat=np.flatnonzero(inside.any(axis=1))
+        ilon=np.flatnonzero(inside.any(axis=0))
+    if len(ilon)==0 or len(ilat)==0:
+        raise ValueError('El dominio {} no contiene puntos de la malla'.format(extent))
+    nlat=lat.shape[0]
+    nlon=lon.shape[-1]
+    return (slice(max(ilat[0]-1, 0), min(ilat[-1]+2, nlat)),
+            slice(max(ilon[0]-1, 0), min(ilon[-1]+2, nlon)))
+
+def _dim_of(root, name):
+    '''
+    dimensión asociada a la variable de coordenadas name
+    '''
+    dims=root.variables[name].dimensions
+    return dims[0] if len(dims)==1 else None
+
+def _time_dim(root, var_name, depth_name):
+    '''
+    la primera dimensión de la variable que no es horizontal ni profundidad
+    '''
+    var=root.variables[var_name]
+    zdim=_dim_of(root, depth_name) if depth_name in root.variables else None
+    for dim in var.dimensions[:-2]:
+        if dim!=zdim:
+            return dim
+    return None
+
+def time_size(root, var_name, depth_name='depth'):
+    '''
+    número de pasos de tiempo de la variable (1 si no tiene dimensión de tiempo)
+    '''
+    tdim=_time_dim(root, var_name, depth_name)
+    return len(root.dimensions[tdim]) if tdim!=None else 1
+
+def time_months(root, var_name, depth_name='depth'):
+    '''
+    mes de cada paso de tiempo, o None si el eje no tiene fechas (variable de
+    coordenadas con units 'days since ...')
+    '''
+    tdim=_time_dim(root, var_name, depth_name)
+    if tdim==None or tdim not in root.variables:
+        return None
+    tvar=root.variables[tdim]
+    units=getattr(tvar, 'units', '')
+    if 'since' not in units:
+        return None
+    import netCDF4 as nc
+    try:
+        dates=nc.num2date(tvar[:], units, getattr(tvar, 'calendar', 'standard'))
+    except (ValueError, TypeError):
+        return None
+    return [date.month for date in np.ravel(dates)]
+
+def month_index(months, size, month):
+    '''
+    paso de tiempo del mes (1-12) en un eje de size pasos
+    months: mes de cada paso, o None si el eje no tiene fechas; sin fechas
+    solo se acepta un eje de 12 pasos mensuales que empieza en enero
+    '''
+    if months is not None:
+        steps=np.flatnonzero(np.asarray(months)==month)
+        if len(steps)==1:
+            return int(steps[0])
+        if len(steps)==0:
+            raise ValueError('El eje de tiempo no tiene pasos del mes {}'.format(month))
+        raise ValueError('El eje de tiempo tiene {} pasos del mes {}; --mes requiere un paso por mes '
+                '(o --backend=xarray --compute_stat)'.format(len(steps), month))
+    if size!=12:
+        raise ValueError('El eje de tiempo no tiene fechas y tiene {} pasos; sin fechas --mes solo '
+                'elige el paso en archivos de 12 meses'.format(size))
+    return month-1
+
+def time_index(root, var_name, month, depth_name='depth'):
+    '''
+    paso de tiempo del mes month (0 si la variable tiene un solo tiempo)
+    '''
+    size=time_size(root, var_name, depth_name)
+    if size<=1:
+        return 0
+    return month_index(time_months(root, var_name, depth_name), size, month)
+
+def read_coords(root, lon_name, lat_name):
+    '''
+    lee las coordenadas lon, lat completas
+    '''
+    lon=np.ma.filled(root.variables[lon_name][:], np.nan)
+    lat=np.ma.filled(root.variables[lat_name][:], np.nan)
+    return lon, lat
+
+def read_slice(root, var_name, lon_name='longitude', lat_name='latitude',
+        depth_name='depth', level=None, time=0, extent=None, method='exact',
+        coords=None, zaxis=None):
+    '''
+    lee solo la rebanada requerida de la variable var_name
+    regresa lon, lat, var y la profundidad usada (None en variables 2D)
+    coords: tupla (lon, lat) ya leída para no volver a leerla
+    zaxis: eje de profundidad ya leído
+    '''
+    var=root.variables[var_name]
+    if coords is None:
+        lon, lat=read_coords(root, lon_name, lat_name)
+    else:
+        lon, lat=coords
+    if extent is not None:
+        slat, slon=extent_window(lon, lat, extent)
+    else:
+        slat=slon=slice(None)
+    if lon.ndim==1:
+        lon, lat=lon[slon], lat[slat]
+    else:
+        lon, lat=lon[slat, slon], lat[slat, slon]
+
+    zdim=None
+    if level is not None:
+        if depth_name in root.variables:
+            zdim=_dim_of(root, depth_name)
+        if zdim not in var.dimensions:
+            raise ValueError('{} no tiene dimensión de profundidad {}'.format(
+                var_name, depth_name))
+        if zaxis is None:
+            zaxis=root.variables[depth_name][:]
+        levels, zvalue=find_level(zaxis, level, method)
+    else:
+        levels, zvalue=[(None, 1.0)], None
+
+    #las dimensiones horizontales son las dos últimas de la variable
+    data=None
+    for ilevel, weight in levels:
+        index=[]
+        for i, dim in enumerate(var.dimensions):
+            if i==var.ndim-2:
+                index.append(slat)
+            elif i==var.ndim-1:
+                index.append(slon)
+            elif dim==zdim:
+                index.append(ilevel)
+            else:
+                index.append(time)
+        values=var[tuple(index)]
+        if weight!=1.0:
+            values=values*weight
+        data=values if data is None else data+values
+    return lon, lat, data, zvalue
+
+class DatasetCache:
+    '''
+    cache LRU de archivos abiertos y de sus coordenadas ya leídas, con llave
+    (ruta, fecha de modificación); si el archivo cambia se vuelve a abrir.
+    max_bytes: memoria máxima de las coordenadas guardadas
+    max_files: número máximo de archivos abiertos
+    '''
+    def __init__(self, max_bytes=512*2**20, max_files=32):
+        self.max_bytes=max_bytes
+        self.max_files=max_files
+        self.entries=OrderedDict()
+        self.nbytes=0
+
+    def _entry(self, path):
+        path=os.path.abspath(path)
+        mtime=os.stat(path).st_mtime_ns
+        entry=self.entries.get(path)
+        if entry!=None and entry['mtime']!=mtime:
+            self._drop(path)
+            entry=None
+        if entry==None:
+            import netCDF4 as nc
+            entry={'mtime':mtime, 'root':nc.Dataset(path, 'r'), 'arrays':{}, 'nbytes':0}
+            self.entries[path]=entry
+            self._evict()
+        self.entries.move_to_end(path)
+        return entry
+
+    def _drop(self, path):
+        entry=self.entries.pop(path)
+        self.nbytes-=entry['nbytes']
+        entry['root'].close()
+
+    def _evict(self):
+        #el archivo más reciente se conserva aunque exceda el límite
+        while len(self.entries)>1 and (len(self.entries)>self.max_files or
+                self.nbytes>self.max_bytes):
+            self._drop(next(iter(self.entries)))
+
+    def _array(self, path, key, read):
+        entry=self._entry(path)
+        if key not in entry['arrays']:
+            value=read(entry['root'])
+            size=sum(np.asarray(v).nbytes for v in value) if isinstance(value, tuple) \
+                    else np.asarray(value).nbytes
+            entry['arrays'][key]=value
+            entry['nbytes']+=size
+            self.nbytes+=size
+            self._evict()
+        return entry['arrays'][key]
+
+    def dataset(self, path):
+        '''
+        archivo abierto; no se debe cerrar, lo cierra el cache
+        '''
+        return self._entry(path)['root']
+
+    def coords(self, path, lon_name, lat_name):
+        return self._array(path, ('coords', lon_name, lat_name),
+                lambda root: read_coords(root, lon_name, lat_name))
+
+    def zaxis(self, path, depth_name):
+        '''
+        eje de profundidad, None si el archivo no lo tiene
+        '''
+        return self._array(path, ('zaxis', depth_name),
+                lambda root: root.variables[depth_name][:] if depth_name in root.variables else None)
+
+    def close(self):
+        for path in list(self.entries):
+            self._drop(path)
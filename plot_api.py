@@ -0,0 +1,110 @@
+'''
+uso de plot_fig como biblioteca, sin la línea de comandos
+un trabajo es un diccionario con las opciones de plot_fig.py sin '--' (como en
+los archivos de trabajos), una cadena de opciones como options de los .inf o
+un Namespace de plot_fig.parser:
+
+    import plot_api
+    figures=plot_api.render({'var_name':'temperatura', 'var_alias':'pot_temp',
+            'tipo':'clim', 'stat':'media', 'modelo':'HYCOM', 'filename':'t.nc',
+            'lat':'Latitude', 'long':'Longitude', 'depth':'Depth', 'level':0})
+    figures=plot_api.render_many(trabajos, workers=4, manifest=Manifest())
+
+importar este módulo no carga matplotlib ni cartopy: se cargan con la primera
+figura, con el backend Agg, así que validar nombres (plot_fig.parse_name), revisar
+trabajos (check) y planear lotes cuesta milisegundos. Las figuras no se
+registran en pyplot y un error no cierra las figuras del programa.
+
+el avance (rutas, títulos) va al logger 'plot_fig' con nivel INFO y no se
+muestra si el programa no configura logging:
+
+    logging.basicConfig(level=logging.INFO)
+'''
+import os
+import shlex
+import argparse as ap
+import plot_fig
+from plot_fig import plan_batch, duplicate_outputs
+from jobs import make_args, validate, option_errors, JobError
+from autoscale import ScaleCache
+
+def job_args(job):
+    '''
+    Namespace de plot_fig del trabajo; JobError si las opciones no son válidas
+    '''
+    if isinstance(job, ap.Namespace):
+        return job
+    if isinstance(job, str):
+        try:
+            args=plot_fig.parser.parse_args(shlex.split(job))
+        except SystemExit:
+            #argparse ya escribió el detalle en stderr
+            raise JobError('Opciones inválidas: '+job)
+        errors=option_errors(args)
+        if errors:
+            raise JobError('Opciones inválidas: {}: {}'.format(job, '; '.join(errors)))
+        return args
+    args, errors=make_args(job, plot_fig.parser)
+    if errors:
+        label=job.get('var_name', '?')
+        raise JobError('Errores en el trabajo {}:\n\t'.format(label)+'\n\t'.join(errors))
+    return args
+
+def resolve(jobs, check_files=True):
+    '''
+    Namespace de cada trabajo y lista de errores de opciones, archivos,
+    variables, niveles y rutas repetidas
+    '''
+    args_list=[]
+    errors=[]
+    for job in jobs:
+        try:
+            args_list.append(job_args(job))
+        except JobError as err:
+            errors.append(str(err))
+    if check_files:
+        errors+=validate(args_list)
+    return args_list, errors+duplicate_outputs(args_list)
+
+def check(jobs):
+    '''
+    errores de los trabajos sin graficar (lista vacía si todo está bien)
+    '''
+    return resolve(jobs)[1]
+
+def render_many(jobs, workers=1, manifest=None, force=False, check_files=True):
+    '''
+    grafica los trabajos, en serie o con workers procesos
+    con manifest solo se grafican las figuras que cambiaron (o todas con force)
+    regresa una lista de diccionarios por figura:
+        {'figname':..., 'path':..., 'seconds':..., 'error':..., 'stages':...}
+    los errores de una figura quedan en 'error' (traceback) sin detener el lote;
+    los errores de opciones o archivos se reportan juntos con JobError antes de
+    graficar
+    '''
+    #antes de que se importe matplotlib; sin efecto si ya se importó
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    args_list, errors=resolve(jobs, check_files)
+    if errors:
+        raise JobError('\n'.join(errors))
+    for args in args_list:
+        #las figuras nunca usan pyplot
+        args.agg=True
+    if any(args.auto_scale for args in args_list):
+        plot_fig.auto_scale(args_list, ScaleCache())
+    tasks, skipped=plan_batch(args_list, manifest, force)
+    results=plot_fig.execute_tasks(tasks, workers)
+    if manifest!=None:
+        plot_fig.update_manifest(manifest, tasks, results)
+    paths={}
+    for task in tasks:
+        paths.update(task[2])
+    return [{'figname':figname, 'path':paths[figname][0], 'seconds':seconds,
+            'error':error, 'stages':stages}
+            for figname, seconds, error, stages in results]
+
+def render(job, **kwargs):
+    '''
+    grafica un trabajo (todos sus niveles/meses); mismas opciones que render_many
+    '''
+    return render_many([job], **kwargs)
@@ -6,13 +6,69 @@ requiere:
 '''
 import os
 import sys
+import logging
+import importlib.util
 import numpy as np
-import netCDF4 as nc
-from map_plots import map_pcolor, map_quiver, add_quiverPlot
+from nc_reader import read_slice, time_index, DatasetCache
+from tiles import render_tiles
+from figure_output import FigureWriter, extension
+from manifest import Manifest, fingerprint, library_versions
+import autoscale
+from jobs import is_job_file, load_jobs, validate, option_errors, JobError
+from autoscale import ScaleCache
+import timing
+from timing import span
+import copy
 import json
 import argparse as ap
 from configparser import ConfigParser
 import shlex
+import time
+import traceback
+import cProfile
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+def lazy_import(name):
+    '''
+    módulo que se carga hasta usar uno de sus atributos; matplotlib y cartopy
+    tardan casi un segundo en importarse y no se necesitan para validar
+    nombres o planear el lote
+    '''
+    if name in sys.modules:
+        return sys.modules[name]
+    spec=importlib.util.find_spec(name)
+    loader=importlib.util.LazyLoader(spec.loader)
+    spec.loader=loader
+    module=importlib.util.module_from_spec(spec)
+    sys.modules[name]=module
+    loader.exec_module(module)
+    return module
+
+map_plots=lazy_import('map_plots')
+
+#avance de las figuras; la línea de comandos lo imprime en stdout, como
+#biblioteca no se muestra si no se configura logging
+log=logging.getLogger('plot_fig')
+
+def pyplot_figures(args):
+    '''
+    números de las figuras abiertas en pyplot; vacío con --agg (las figuras no
+    se registran) o si pyplot no se ha importado
+    '''
+    if args.agg or 'matplotlib.pyplot' not in sys.modules:
+        return set()
+    return set(sys.modules['matplotlib.pyplot'].get_fignums())
+
+def close_new_figures(args, before):
+    '''
+    cierra solo las figuras de pyplot que quedaron abiertas por un error
+    (before: pyplot_figures antes de graficar); no toca las demás figuras
+    del proceso ni importa matplotlib
+    '''
+    for number in pyplot_figures(args)-before:
+        sys.modules['matplotlib.pyplot'].close(number)
 
 def parse_name(figname):
     '''
@@ -96,24 +152,308 @@ def parse_units(units):
     else:
         return units
 
-def plot(args):
-    path=os.path.join(create_tree(args),args.figname)
-    print(path)
-    month={
-            1:'Enero',
-            2:'Febrero',
-            3:'Marzo',
-            4:'Abril',
-            5:'Mayo',
-            6:'Junio',
-            7:'Julio',
-            8:'Agosto',
-            9:'Septiembre',
-            10:'Octubre',
-            11:'Noviembre',
-            12:'Diciembre',
-            }
-    #TITLE
+#tamaño de la figura en pixeles (8 pulgadas a 200 dpi): máximo de celdas útiles por eje
+MAX_CELLS=8*200
+
+def decimate_options(args):
+    '''
+    opciones de map_pcolor para --decimate
+    '''
+    if args.decimate==None:
+        return {}
+    return {'max_cells':MAX_CELLS, 'decimate_method':args.decimate}
+
+#mapas base reutilizables (--template), uno por dominio y paleta en cada proceso
+templates={}
+
+def template_key(args, lon, lat):
+    '''
+    llave de la plantilla: forma y límites de la malla, dominio y paleta
+    '''
+    bounds=tuple(float(x) for x in (lon.min(), lon.max(), lat.min(), lat.max()))
+    extent=tuple(args.extent) if args.extent!=None else None
+    return (lon.shape, lat.shape, bounds, extent, args.cmap, args.decimate)
+
+def var_name_of(args):
+    '''
+    nombre de la variable dentro del archivo
+    '''
+    if args.var_alias!=None:
+        return args.var_alias
+    return args.var_name
+
+def read_frame(root, args, coords=None, var_name=None, zaxis=None):
+    '''
+    lee del archivo abierto la rebanada de un nivel/mes
+    regresa lon, lat, var, units
+    coords: (lon, lat) ya leídas del mismo archivo
+    var_name: variable a leer, por omisión la de --var_alias/--var_name
+    zaxis: eje de profundidad ya leído del mismo archivo
+    '''
+    if var_name==None:
+        var_name=var_name_of(args)
+    if args.compute_stat:
+        raise ValueError('--compute_stat requiere --backend=xarray')
+    #archivos con varios tiempos: el mes selecciona el paso de tiempo
+    itime=0
+    if args.mes!=None:
+        itime=time_index(root, var_name, args.mes, args.depth)
+    lon, lat, var, zvalue=read_slice(root, var_name,
+            lon_name=args.long,
+            lat_name=args.lat,
+            depth_name=args.depth,
+            level=args.level,
+            time=itime,
+            extent=args.extent,
+            method=args.level_method,
+            coords=coords,
+            zaxis=zaxis)
+    if zvalue!=None and zvalue!=args.level:
+        log.warning('Nivel {} m no existe, se usa {} ({:g} m)'.format(
+            args.level, args.level_method, zvalue))
+    #time=nc.num2date(root.variables['time'][:], root.variables['time'].units)
+    if args.units==None:
+        units=root.variables[var_name].units
+    else:
+        units=args.units
+    return lon, lat, var, units
+
+def figure_path(args):
+    '''
+    ruta de la figura sin extensión (save_figure agrega la del formato)
+    '''
+    return os.path.join(create_tree(args),args.figname)
+
+def output_path(args):
+    '''
+    archivo que produce la figura: el PNG o el tiles.json de la pirámide de teselas
+    '''
+    if args.tiles!=None:
+        return os.path.join(figure_path(args)+'_tiles', 'tiles.json')
+    return figure_path(args)+extension(args.format)
+
+#guardado de figuras: bbox precalculados y codificación en segundo plano
+writer=FigureWriter()
+
+def save_figure(args, figure, path, layout, figname=None):
+    '''
+    guarda la figura con el formato, compresión y bbox de la sección
+    layout: llave de las figuras que comparten diseño y bbox
+    figname: nombre con que se reportan los errores (por omisión args.figname)
+    '''
+    return writer.save(figure, path,
+            fmt=args.format,
+            compress_level=args.compress_level,
+            bbox=args.bbox,
+            background=args.background_save,
+            layout=layout,
+            name=figname or args.figname)
+
+def is_vector(args):
+    '''
+    True si la sección grafica una variable vectorial (--xcomp y --ycomp)
+    '''
+    return args.xcomp!=None and args.ycomp!=None
+
+#archivos abiertos y coordenadas leídas, compartidos entre secciones
+#(en el proceso lector de la componente Y hay otro cache)
+datasets=DatasetCache()
+
+#--cache_mb por omisión
+DEFAULT_CACHE_MB=512
+
+def read_cached(path, args, var_name=None):
+    '''
+    lee la rebanada de var_name en el archivo path usando el cache de archivos
+    '''
+    with span('open'):
+        root=datasets.dataset(path)
+    with span('coords'):
+        coords=datasets.coords(path, args.long, args.lat)
+        zaxis=datasets.zaxis(path, args.depth) if args.level!=None else None
+    return read_frame(root, args, coords, var_name, zaxis)
+
+def read_frame_file(path, args, var_name):
+    '''
+    lee la rebanada de var_name en el archivo path; se ejecuta en un proceso
+    aparte y conserva el archivo abierto entre figuras
+    '''
+    return read_cached(path, args, var_name)[2]
+
+def read_frame_xr(root, args, var_name=None):
+    '''
+    como read_frame pero del dataset de xarray (--backend=xarray); con
+    --compute_stat la estadística de --stat se calcula sobre el tiempo
+    (solo el mes --mes en figuras mensuales)
+    '''
+    import xr_reader
+    if var_name==None:
+        var_name=var_name_of(args)
+    stat=month=None
+    itime=0
+    if args.compute_stat:
+        if args.tipo=='estacional':
+            raise ValueError('--compute_stat no admite --tipo=estacional')
+        stat=args.stat
+        if args.tipo=='mensual':
+            month=args.mes
+    elif args.mes!=None:
+        itime=xr_reader.time_index(root, var_name, args.mes, args.depth)
+    lon, lat, var, zvalue=xr_reader.read_slice(root, var_name,
+            lon_name=args.long,
+            lat_name=args.lat,
+            depth_name=args.depth,
+            level=args.level,
+            time=itime,
+            extent=args.extent,
+            method=args.level_method,
+            stat=stat,
+            month=month)
+    if zvalue!=None and zvalue!=args.level:
+        log.warning('Nivel {} m no existe, se usa {} ({:g} m)'.format(
+            args.level, args.level_method, zvalue))
+    if args.units==None:
+        units=root[var_name].attrs['units']
+    else:
+        units=args.units
+    return lon, lat, var, units
+
+@contextmanager
+def open_xarray(args):
+    '''
+    open_source con --backend=xarray: --filename (o --xfilename/--yfilename)
+    puede ser un patrón con varios archivos que se leen en bloques con dask
+    '''
+    import xr_reader
+    chunks=xr_reader.parse_chunks(args.chunks) if args.chunks!=None else None
+    if is_vector(args):
+        xfilename=args.xfilename if args.xfilename!=None else args.filename
+        yfilename=args.yfilename if args.yfilename!=None else xfilename
+    else:
+        xfilename=yfilename=args.filename
+    roots={}
+    try:
+        with span('open'):
+            for filename in (xfilename, yfilename):
+                if filename not in roots:
+                    roots[filename]=xr_reader.open_dataset(filename, chunks)
+        if not is_vector(args):
+            yield lambda frame: read_frame_xr(roots[xfilename], frame)
+            return
+        def read(frame):
+            lon, lat, u, units=read_frame_xr(roots[xfilename], frame, frame.xcomp)
+            v=read_frame_xr(roots[yfilename], frame, frame.ycomp)[2]
+            return lon, lat, (u, v), units
+        yield read
+    finally:
+        for root in roots.values():
+            root.close()
+
+@contextmanager
+def open_source(args):
+    '''
+    regresa la función read(frame) que lee los datos de cada figura:
+    (lon, lat, var, units), con var=(u, v) en variables vectoriales
+    los archivos quedan abiertos en el cache datasets para las siguientes secciones
+    '''
+    if args.backend=='xarray':
+        with open_xarray(args) as read:
+            yield read
+        return
+    if not is_vector(args):
+        #abre el archivo desde aquí para reportar un archivo faltante en toda la sección
+        with span('open'):
+            datasets.dataset(args.filename)
+        yield lambda frame: read_cached(frame.filename, frame)
+        return
+    xfilename=args.xfilename if args.xfilename!=None else args.filename
+    yfilename=args.yfilename if args.yfilename!=None else xfilename
+    with span('open'):
+        datasets.dataset(xfilename)
+    if os.path.abspath(yfilename)==os.path.abspath(xfilename):
+        def read(frame):
+            lon, lat, u, units=read_cached(xfilename, frame, frame.xcomp)
+            v=read_cached(xfilename, frame, frame.ycomp)[2]
+            return lon, lat, (u, v), units
+        yield read
+        return
+    #netcdf-c no es seguro con hilos: la componente Y se lee en otro proceso
+    #mientras este proceso lee la componente X
+    with ProcessPoolExecutor(max_workers=1) as reader:
+        def read(frame):
+            future=reader.submit(read_frame_file, yfilename, frame, frame.ycomp)
+            lon, lat, u, units=read_cached(xfilename, frame, frame.xcomp)
+            return lon, lat, (u, future.result()), units
+        yield read
+
+#vector de referencia con --speed (fracción del eje)
+SPEED_KEY_POSITION={'x':0.95, 'y':1.035}
+
+def plot_vector(args, path, title, data, tickBins, annotation):
+    '''
+    grafica vectores (u, v) adelgazados; con --speed sobre la rapidez en pcolormesh
+    '''
+    lon, lat, (u, v), units=data
+    if args.speed:
+        ax, figure = map_plots.map_pcolor(lon, lat, np.ma.sqrt(u**2+v**2),
+                title=title,
+                tickBins=tickBins,
+                cmap=args.cmap,
+                plot_land=True,
+                extent=args.extent,
+                vmin=args.vmin,
+                vmax=args.vmax,
+                pyplot=not args.agg,
+                **decimate_options(args))
+        with span('quiver'):
+            #la barra de color ocupa el lugar del vector de referencia debajo del
+            #mapa: va arriba a la derecha, fuera del mapa
+            map_plots.add_quiverPlot(ax, lon, lat, u, v,
+                    quiverkeyunits=units+')',
+                    quiverkeyposition=SPEED_KEY_POSITION,
+                    quiverkeylabelpos='W',
+                    arrow_density=args.arrow_density,
+                    extent=args.extent)
+    else:
+        ax, figure = map_plots.map_quiver(lon, lat, u, v,
+                title=title,
+                tickBins=tickBins,
+                quiverkeyunits=units+')',
+                arrow_density=args.arrow_density,
+                plot_land=True,
+                extent=args.extent,
+                pyplot=not args.agg)
+    with map_plots.managed_figure(figure):
+        if annotation!=None:
+            ax.annotate(annotation,xy=(0.02,0.94), xycoords='axes fraction')
+        with span('savefig'):
+            save_figure(args, figure, path, ('vector', lon.shape, args.extent, args.speed, title))
+
+MONTHS={
+        1:'Enero',
+        2:'Febrero',
+        3:'Marzo',
+        4:'Abril',
+        5:'Mayo',
+        6:'Junio',
+        7:'Julio',
+        8:'Agosto',
+        9:'Septiembre',
+        10:'Octubre',
+        11:'Noviembre',
+        12:'Diciembre',
+        }
+
+#marcadores de los ejes para el dominio del Golfo de México
+TICK_BINS={
+        'x':[-98,-95,-92,-89,-86,-83,-80,-77],
+        'y':[18,20,22,24,26,28,30,32],
+        }
+
+def make_title(args, units):
+    '''
+    título de la figura a partir de las opciones
+    '''
     title=args.stat
     title=title[0].upper()+title[1:]
     if args.stat=='media':
@@ -132,43 +472,191 @@ def plot(args):
         title+=args.var_name
     if args.level!=None:
         title+=' a '+str(args.level)+' m '
-    if args.var_alias!=None:
-        var_name=args.var_alias
-    else:
-        var_name=args.var_name
-    with nc.Dataset(args.filename, 'r') as root:
-        if args.level!=None:
-            z=root.variables[args.depth][:]
-            idepth=np.argwhere(z==args.level)[0][0]
-            var=root.variables[var_name][0][idepth]
-        else:
-            var=root.variables[var_name][0]
-        lon=root.variables[args.long][:]
-        lat=root.variables[args.lat][:]
-        #time=nc.num2date(root.variables['time'][:], root.variables['time'].units)
-        if args.units==None:
-            units=root.variables[var_name].units
-        else:
-            units=args.units
-
-    units='['+units+']'
-    title+=units
+    title+='['+units+']'
     title+=' Modelo '+args.modelo
-    print(title)
+    return title
+
+def plot(args, data=None):
+    '''
+    grafica una figura; data=(lon, lat, var, units) si ya se leyó la rebanada
+    '''
+    path=figure_path(args)
+    log.info(path)
+    if data==None:
+        with open_source(args) as read:
+            data=read(args)
+    lon, lat, var, units=data
+    if args.tiles!=None:
+        if is_vector(args):
+            u, v=var
+            var=np.ma.sqrt(u**2+v**2)
+        with span('tiles'):
+            meta=render_tiles(lon, lat, var, path+'_tiles', args.tiles, cmap=args.cmap,
+                    vmin=args.vmin, vmax=args.vmax, jobs=args.tile_jobs)
+        log.info('teselas: %s vacías: %s', meta['tiles'], meta['empty'])
+        return
+    title=make_title(args, units)
+    log.info(title)
+
+    #addCoordinateTicks modifica el diccionario
+    tickBins=dict(TICK_BINS)
+    annotation=MONTHS[args.mes] if args.tipo=='mensual' else None
+    if is_vector(args):
+        plot_vector(args, path, title, data, tickBins, annotation)
+        return
+    if args.template:
+        key=template_key(args, lon, lat)
+        if key in templates:
+            with span('template_update'):
+                templates[key].update(var, title=title, vmin=args.vmin, vmax=args.vmax,
+                        annotation=annotation)
+        else:
+            templates[key]=map_plots.MapTemplate(lon, lat, var,
+                    title=title,
+                    tickBins=tickBins,
+                    cmap=args.cmap,
+                    plot_land=True,
+                    extent=args.extent,
+                    vmin=args.vmin,
+                    vmax=args.vmax,
+                    **decimate_options(args))
+            templates[key].annotate(annotation)
+        with span('savefig'):
+            save_figure(args, templates[key].fig, path, ('plantilla',)+key+(title,))
+        return
 
-    ax, figure = map_pcolor(lon, lat, var,
+    ax, figure = map_plots.map_pcolor(lon, lat, var,
             title=title,
-            tickBins={
-                'x':[-98,-95,-92,-89,-86,-83,-80,-77],
-                'y':[18,20,22,24,26,28,30,32],
-                },
+            tickBins=tickBins,
             cmap=args.cmap,
             plot_land=True,
+            extent=args.extent,
             vmin=args.vmin,
-            vmax=args.vmax)
-    if args.tipo=='mensual':
-        ax.annotate(month[args.mes],xy=(0.02,0.94), xycoords='axes fraction')
-    figure.savefig(path, bbox_inches='tight', dpi=200)
+            vmax=args.vmax,
+            pyplot=not args.agg,
+            **decimate_options(args))
+    with map_plots.managed_figure(figure):
+        if annotation!=None:
+            ax.annotate(annotation,xy=(0.02,0.94), xycoords='axes fraction')
+        with span('savefig'):
+            save_figure(args, figure, path, ('mapa',)+template_key(args, lon, lat)+(title,))
+
+def panel_args(args):
+    '''
+    copia de args con el nombre de la figura de paneles: se omiten del nombre
+    el nivel y el mes si varían entre paneles y se agrega _paneles
+    '''
+    panel=copy.copy(args)
+    if args.level!=None and len(args.level)==1:
+        panel.level=args.level[0]
+    else:
+        panel.level=None
+    if args.mes!=None and len(args.mes)==1:
+        panel.mes=args.mes[0]
+    else:
+        panel.mes=None
+    panel.figname=set_figname(panel)+'_paneles'
+    return panel
+
+def panel_title(frame, args):
+    '''
+    título de cada panel: mes y/o nivel que varían en la sección
+    '''
+    parts=[]
+    if args.mes!=None and len(args.mes)>1:
+        parts.append(MONTHS[frame.mes])
+    if args.level!=None and len(args.level)>1:
+        parts.append(str(frame.level)+' m')
+    return ', '.join(parts)
+
+def plot_panels(args, frames, datas):
+    '''
+    grafica todos los niveles/meses de la sección en una sola figura de paneles
+    datas: lista de (lon, lat, var, units) de cada frame
+    '''
+    panel=panel_args(args)
+    path=figure_path(panel)
+    log.info(path)
+    title=make_title(panel, datas[0][3])
+    panels=[]
+    for frame, (lon, lat, var, units) in zip(frames, datas):
+        item={'lon':lon, 'lat':lat, 'title':panel_title(frame, args)}
+        if is_vector(frame):
+            u, v=var
+            item.update(z=np.ma.sqrt(u**2+v**2), u=u, v=v)
+        else:
+            item['z']=var
+        panels.append(item)
+    vmin, vmax=args.vmin, args.vmax
+    if args.scales!=None:
+        lows, highs=zip(*args.scales.values())
+        vmin=min(lows) if vmin==None else vmin
+        vmax=max(highs) if vmax==None else vmax
+    nrows, ncols=args.panels
+    axes, figure = map_plots.map_panels(panels, nrows, ncols,
+            title=title,
+            #la mitad de las marcas para que quepan en cada panel
+            tickBins={k:v[::2] for k,v in TICK_BINS.items()},
+            cmap=args.cmap,
+            plot_land=True,
+            extent=args.extent,
+            vmin=vmin,
+            vmax=vmax,
+            pyplot=not args.agg,
+            arrow_density=args.arrow_density,
+            quiverkeyunits=datas[0][3]+')',
+            **decimate_options(args))
+    with map_plots.managed_figure(figure):
+        with span('savefig'):
+            save_figure(args, figure, path, ('paneles', len(panels), args.panels, args.extent, title),
+                    panel.figname)
+    return panel.figname
+
+def close_templates():
+    '''
+    cierra y descarta los mapas base de --template
+    '''
+    for template in templates.values():
+        template.close()
+    templates.clear()
+
+def int_list(value):
+    '''
+    convierte '0,50,100', '1-12' o '0-100:50' (inicio-fin:paso) en lista de enteros
+    '''
+    values=[]
+    for item in value.split(','):
+        rng, _, step=item.strip().partition(':')
+        if '-' in rng[1:]:
+            i=rng.index('-',1)
+            values+=list(range(int(rng[:i]), int(rng[i+1:])+1, int(step) if step else 1))
+        else:
+            values.append(int(rng))
+    return values
+
+def month_list(value):
+    '''
+    int_list de meses; solo se aceptan meses de 1 a 12
+    '''
+    months=int_list(value)
+    invalid=[month for month in months if not 1<=month<=12]
+    if invalid:
+        raise ap.ArgumentTypeError('meses fuera de 1-12: {}'.format(invalid))
+    return months
+
+def grid_shape(value):
+    '''
+    convierte 'RxC' (renglones x columnas) en tupla de enteros
+    '''
+    rows, _, cols=value.lower().partition('x')
+    try:
+        return int(rows), int(cols)
+    except ValueError:
+        raise ap.ArgumentTypeError('Se esperaba RENGLONESxCOLUMNAS, p.ej. 3x4: '+value)
+
+#opciones de línea de comandos que aplican a todas las secciones del archivo
+BATCH_OPTIONS=['template','agg','profile','cprofile','tile_jobs','cache_mb',
+        'format','compress_level','bbox','background_save','auto_scale','percentiles']
 
 #parsing args
 parser= ap.ArgumentParser()
@@ -178,7 +666,7 @@ parser.add_argument("--tipo", help="Tipo de figura",
         )
 group.add_argument("--var_name", help="Nombre de la variable",
         choices=["capa-mezcla","nivel-mar", "temperatura", "salinidad", "viento",
-        "nitratos","carbono","clorofila"],
+        "velocidad","nitratos","carbono","clorofila"],
         )
 parser.add_argument("--var_name_title", help="Nombre de la variable que se colocará en el título")
 parser.add_argument("--var_alias", help="Nombre de la variable en el archivo")
@@ -186,49 +674,457 @@ parser.add_argument("--stat", help="Operación estadística aplicada",
         choices=["media","desviacion-estandar","maximos","minimos","promedio"],
         )
 parser.add_argument("--filename", help="Nombre del archivo")
+parser.add_argument("--backend", choices=["netcdf","xarray"], default="netcdf",
+        help="Lectura con netCDF4 (por omisión) o xarray/dask; con xarray --filename puede ser un patrón (p.ej. 'diarios/*.nc')")
+parser.add_argument("--chunks", metavar="DIM=N,...",
+        help="Tamaño de bloque de dask por dimensión con --backend=xarray (p.ej. time=30)")
+parser.add_argument("--compute_stat", action="store_true",
+        help="Con --backend=xarray calcula --stat sobre el eje de tiempo en lugar de leer un archivo ya calculado")
 parser.add_argument("--ID", help="Clave del modelo",
         default="gom-unam-hycom-ioa-gom-phy-025",
         )
-parser.add_argument("--level", type=int, help="Profundidad en m")
-parser.add_argument("--mes", type=int, help="Número del mes")
+parser.add_argument("--level", type=int_list,
+        help="Profundidad(es) en m. Ej: 0 | 0,50,100,250 | 0-100:50")
+parser.add_argument("--level_method", default="exact",
+        choices=["exact","nearest","interp"],
+        help="Búsqueda del nivel cuando no existe en la malla")
+parser.add_argument("--extent", type=float, nargs=4,
+        metavar=('LONMIN','LONMAX','LATMIN','LATMAX'),
+        help="Dominio de la gráfica, solo se lee esta ventana del archivo")
+parser.add_argument("--decimate", choices=["mean","max"],
+        help="Reduce por bloques las mallas con más celdas que pixeles en la figura")
+parser.add_argument("--mes", type=month_list, help="Número(s) del mes. Ej: 7 | 1-12 | 1,4,7,10")
 parser.add_argument("--root", help="Path de la carpeta raíz")
 parser.add_argument("--cmap", help="Paleta de la barra de colores")
 parser.add_argument("--vmin", type=float, help="Valor mínimo en la barra de colores")
 parser.add_argument("--vmax", type=float, help="Valor máximo en la barra de colores")
+parser.add_argument("--auto_scale", action="store_true",
+        help="Sin --vmin/--vmax usa límites comunes a todas las figuras de la misma variable, estadística y nivel")
+parser.add_argument("--percentiles", type=float, nargs=2, metavar=("BAJO","ALTO"),
+        help="Percentiles de --auto_scale (por omisión 2 98)")
 parser.add_argument("--title", help="Título en la gráfica")
 parser.add_argument("--xcomp", help="Componente X en variables vectoriales")
 parser.add_argument("--xfilename", help="Archivo con la componente X")
 parser.add_argument("--ycomp", help="Componente Y en variables vectoriales")
 parser.add_argument("--yfilename", help="Archivo con la componente Y")
+parser.add_argument("--panels", type=grid_shape, metavar="RxC",
+        help="Grafica todos los niveles/meses de la sección en una figura de RxC paneles")
+parser.add_argument("--tiles", type=int_list, metavar="ZOOMS",
+        help="Genera teselas XYZ en Web Mercator para los zooms indicados (p.ej. 3-7) en lugar de la figura")
+parser.add_argument("--tile_jobs", type=int,
+        help="Procesos para generar teselas (por omisión uno por CPU)")
+parser.add_argument("--format", choices=["png","png8","webp"],
+        help="Formato de la figura: png (por omisión), png8 (paleta de 256 colores) o webp")
+parser.add_argument("--compress_level", type=int,
+        help="Compresión: 0-9 en PNG (más bajo es más rápido), 0-6 en WebP")
+parser.add_argument("--bbox", choices=["tight","fija"],
+        help="tight: recorte calculado en cada figura (por omisión); fija: se calcula una vez por diseño y se reutiliza")
+parser.add_argument("--background_save", action="store_true",
+        help="Codifica la figura en un hilo mientras se dibuja la siguiente")
+parser.add_argument("--speed", action="store_true",
+        help="En variables vectoriales grafica la rapidez debajo de los vectores")
+parser.add_argument("--arrow_density", type=float, default=3,
+        help="Flechas por pulgada en variables vectoriales")
 parser.add_argument("--lat", default="latitude", help="Nombre de la variable de latitud")
 parser.add_argument("--long", default="longitude",help="Nombre de la variable de longitud")
 parser.add_argument("--depth", default="depth",help="Nombre de la variable de profundidad")
 parser.add_argument("--units", help="Especifica unidades de la variable")
 parser.add_argument("--modelo", help="Especifica el modelo usado")
-group.add_argument('-i',"--input", help="Archivo(s) de entrada", dest='config_file')
-
-#parser.add_argument("--figname", help="Nombre de la figura")
-args=parser.parse_args()
-
-if args.config_file==None:
-    args_list=[args]
-else:
-    args_list=[]
-    print('Reading:',args.config_file)
-    file_parser=ConfigParser()
-    file_parser.read(args.config_file)
-    print('Variables detectadas:', )
-    for section_name in file_parser.sections():
-        print('\t> ',section_name)
-        arg_line=shlex.split('--var_name='+section_name+' '+\
-                file_parser.get(section_name,'options'))
-        args_list.append(parser.parse_args(arg_line))
-for args in args_list:
-    print('--> Graficando', args.var_name,'<--')
+group.add_argument('-i',"--input", help="Archivo(s) de entrada: .inf o trabajos .yaml/.toml/.json", dest='config_file')
+parser.add_argument("--check", action="store_true",
+        help="Solo valida opciones, archivos, variables, coordenadas y niveles, sin graficar")
+
+parser.add_argument("--template", action="store_true",
+        help="Reutiliza el mapa base entre figuras con el mismo dominio y paleta")
+parser.add_argument("--agg", action="store_true",
+        help="Dibuja con Agg directamente, sin registrar las figuras en pyplot")
+parser.add_argument("--force", action="store_true",
+        help="Grafica todas las figuras aunque estén al día en el manifiesto")
+parser.add_argument("--no_manifest", action="store_true",
+        help="No usa ni actualiza el manifiesto Figuras/.manifest.json")
+parser.add_argument("--profile", metavar="REPORTE",
+        help="Mide cada etapa y escribe el reporte por figura (.csv o .json)")
+parser.add_argument("--cprofile", metavar="CARPETA",
+        help="Guarda un perfil de cProfile por figura en la carpeta")
+parser.add_argument("-j","--jobs", type=int, default=1,
+        help="Número de procesos para graficar las secciones en paralelo")
+parser.add_argument("--cache_mb", type=int,
+        help="Memoria máxima (MB) de coordenadas en el cache de archivos abiertos por proceso (512)")
+#límites por nivel que calcula --auto_scale (no es opción de línea de comandos)
+parser.set_defaults(scales=None)
+
+def apply_batch_options(args_list, args):
+    '''
+    BATCH_OPTIONS de la línea de comandos en las secciones que no las indican;
+    el valor de la sección se conserva aunque sea 0 (solo None o False se
+    reemplazan)
+    '''
+    for section_args in args_list:
+        for name in BATCH_OPTIONS:
+            value=getattr(section_args, name)
+            if value is None or value is False:
+                setattr(section_args, name, getattr(args, name))
+
+def expand_frames(args):
+    '''
+    una copia de args por cada combinación de nivel y mes
+    '''
+    levels=args.level if args.level!=None else [None]
+    months=args.mes if args.mes!=None else [None]
+    frames=[]
+    for level in levels:
+        for mes in months:
+            frame=copy.copy(args)
+            frame.level=level
+            frame.mes=mes
+            #límites de --auto_scale del nivel, sin reemplazar --vmin/--vmax
+            frame.scales=None
+            if args.scales!=None and level in args.scales:
+                vmin, vmax=args.scales[level]
+                frame.vmin=vmin if args.vmin==None else args.vmin
+                frame.vmax=vmax if args.vmax==None else args.vmax
+            frames.append(frame)
+    return frames
+
+def set_figname(args):
+    '''
+    construye el nombre de la figura a partir de las opciones
+    '''
     figname='_'.join([args.ID,args.tipo,args.var_name,args.stat])
     if args.level!=None:
         figname+='_'+'{:04d}'.format(args.level)+'m'
     if args.mes!=None:
         figname+='_M'+'{:02d}'.format(args.mes)
     args.figname=figname
-    plot(args)
+    return figname
+
+def plot_task(args, frames=None):
+    '''
+    grafica todos los niveles/meses de una sección abriendo el archivo una vez
+    frames: subconjunto de expand_frames(args) a graficar (por omisión todos)
+    regresa lista de (figname, tiempo, error, etapas); los errores se reportan
+    sin detener el lote. etapas={etapa: segundos} con --profile
+    '''
+    log.info('--> Graficando %s <--', args.var_name)
+    if frames==None:
+        frames=expand_frames(args)
+        for frame in frames:
+            set_figname(frame)
+    profile=args.profile!=None
+    datasets.max_bytes=(args.cache_mb if args.cache_mb!=None else DEFAULT_CACHE_MB)*2**20
+    results=[]
+    try:
+        t0=time.perf_counter()
+        #la apertura del archivo se cuenta en la primera figura
+        if profile:
+            timing.start_figure()
+        with open_source(args) as read:
+            if args.panels!=None:
+                #una sola figura con todos los niveles/meses
+                figname=panel_args(args).figname
+                error=None
+                before=pyplot_figures(args)
+                try:
+                    with span('read'):
+                        datas=[read(frame) for frame in frames]
+                    plot_panels(args, frames, datas)
+                    error=writer.wait().get(figname)
+                except Exception:
+                    error=traceback.format_exc()
+                    close_new_figures(args, before)
+                results.append((figname, time.perf_counter()-t0, error, timing.end_figure()))
+                return results
+            for frame in frames:
+                if profile and not timing.enabled():
+                    timing.start_figure()
+                if args.cprofile!=None:
+                    profiler=cProfile.Profile()
+                    profiler.enable()
+                error=None
+                before=pyplot_figures(args)
+                try:
+                    with span('read'):
+                        data=read(frame)
+                    plot(frame, data)
+                except Exception:
+                    error=traceback.format_exc()
+                    #figuras que quedaron abiertas por el error
+                    close_new_figures(args, before)
+                if args.cprofile!=None:
+                    profiler.disable()
+                    os.makedirs(args.cprofile, exist_ok=True)
+                    profiler.dump_stats(os.path.join(args.cprofile, frame.figname+'.prof'))
+                results.append((frame.figname, time.perf_counter()-t0, error,
+                    timing.end_figure()))
+                t0=time.perf_counter()
+            #errores de las figuras codificadas en segundo plano, cada uno en
+            #el renglón de su figura
+            failures=writer.wait()
+            results=[(figname, seconds, failures.get(figname, error), stages)
+                    for figname, seconds, error, stages in results]
+    except Exception:
+        #el archivo no se pudo abrir o leer
+        error=traceback.format_exc()
+        timing.end_figure()
+        if args.panels!=None:
+            return [(panel_args(args).figname, 0.0, error, {})]
+        done=len(results)
+        results+=[(frame.figname, 0.0, error, {}) for frame in frames[done:]]
+    return results
+
+def print_summary(results, elapsed, skipped=0):
+    '''
+    imprime el resumen del lote con los tiempos por figura
+    '''
+    fails=[r for r in results if r[2]!=None]
+    print('Resumen:')
+    for figname, t, error, stages in results:
+        status='ERROR' if error!=None else 'ok'
+        print('\t{:>8.2f} s  {:5}  {}'.format(t, status, figname))
+    print('Figuras: {}, errores: {}, sin cambios: {}, tiempo total: {:.2f} s'.format(
+        len(results), len(fails), skipped, elapsed))
+    for figname, t, error, stages in fails:
+        print('--> Error en', figname)
+        print(error)
+
+#percentiles de --auto_scale por omisión
+DEFAULT_PERCENTILES=[2, 98]
+
+def scan_group(members, percentiles):
+    '''
+    percentiles de todas las rebanadas de un grupo, en una pasada y sin
+    guardarlas; members: lista de (sección, frame)
+    '''
+    estimator=autoscale.StreamingQuantiles()
+    sections={}
+    for args, frame in members:
+        sections.setdefault(id(args), (args, []))[1].append(frame)
+    for args, frames in sections.values():
+        try:
+            with open_source(args) as read:
+                for frame in frames:
+                    lon, lat, var, units=read(frame)
+                    if is_vector(frame):
+                        u, v=var
+                        var=np.ma.sqrt(u**2+v**2)
+                    estimator.add(var)
+        except Exception as err:
+            #el error se reporta al graficar la sección
+            log.warning('No se pudo leer %s para la escala: %s', args.var_name, err)
+    return estimator.quantiles(percentiles)
+
+def auto_scale(args_list, cache):
+    '''
+    --auto_scale: vmin/vmax comunes por variable, estadística y nivel con los
+    percentiles --percentiles de todas las rebanadas del lote; quedan en
+    args.scales={nivel: [vmin, vmax]} de cada sección. Los grupos cuyas
+    opciones y archivos no cambiaron se toman del cache
+    '''
+    versions=library_versions()
+    groups={}
+    for args in args_list:
+        if not args.auto_scale or (args.vmin!=None and args.vmax!=None):
+            continue
+        for frame in expand_frames(args):
+            groups.setdefault(autoscale.group_key(frame), []).append((args, frame))
+    for key, members in groups.items():
+        percentiles=members[0][0].percentiles or DEFAULT_PERCENTILES
+        fprints=[]
+        for args, frame in members:
+            frame.vmin=frame.vmax=None
+            fprints.append(fingerprint(frame, versions))
+        sign=autoscale.signature(fprints, percentiles)
+        limits=cache.get(key, sign) if None not in fprints else None
+        if limits==None:
+            limits=scan_group(members, percentiles)
+            if limits==None:
+                continue
+            cache.update(key, sign, *limits)
+        log.info('Escala {}: {:g} a {:g}'.format(key, *limits))
+        for args, frame in members:
+            if args.scales==None:
+                args.scales={}
+            args.scales[frame.level]=list(limits)
+    cache.save()
+    #los archivos que abrió la lectura no deben heredarse a los procesos del
+    #pool (los manejadores de HDF5 no son seguros después de fork)
+    datasets.close()
+
+def duplicate_outputs(args_list):
+    '''
+    figuras que más de una sección escribiría en la misma ruta
+    (sin crear las carpetas, como lo hace figure_path)
+    '''
+    owners={}
+    for args in args_list:
+        frames=[panel_args(args)] if args.panels!=None else expand_frames(args)
+        for frame in frames:
+            if args.panels==None:
+                set_figname(frame)
+            key=(frame.tipo, frame.var_name, frame.stat, frame.figname,
+                    frame.tiles!=None, extension(frame.format))
+            owners.setdefault(key, []).append(args.var_name)
+    return ['{} se escribe en {} secciones ({})'.format(key[3], len(names), ', '.join(names))
+            for key, names in owners.items() if len(names)>1]
+
+def plan_batch(args_list, manifest=None, force=False):
+    '''
+    expande las secciones en figuras y descarta las que están al día en el manifiesto
+    regresa lista de (args, frames, huellas) y el número de figuras omitidas
+    '''
+    versions=library_versions()
+    tasks=[]
+    skipped=0
+    for args in args_list:
+        if args.panels!=None:
+            frames=expand_frames(args)
+            for frame in frames:
+                set_figname(frame)
+            panel=panel_args(args)
+            figpath=figure_path(panel)+extension(args.format)
+            fprint=fingerprint(args, versions)
+            if not force and manifest!=None and manifest.is_current(figpath, fprint):
+                skipped+=1
+            else:
+                tasks.append((args, frames, {panel.figname:(figpath, fprint)}))
+            continue
+        frames=[]
+        prints={}
+        for frame in expand_frames(args):
+            set_figname(frame)
+            fprint=fingerprint(frame, versions)
+            if not force and manifest!=None and \
+                    manifest.is_current(output_path(frame), fprint):
+                skipped+=1
+                continue
+            frames.append(frame)
+            prints[frame.figname]=(output_path(frame), fprint)
+        if len(frames)>0:
+            tasks.append((args, frames, prints))
+    return tasks, skipped
+
+def close_caches():
+    '''
+    cierra mapas base, archivos abiertos y el guardado en segundo plano
+    '''
+    close_templates()
+    datasets.close()
+    writer.close()
+
+def execute_tasks(tasks, jobs=1):
+    '''
+    grafica las tareas de plan_batch, en serie o en un pool de procesos
+    cada proceso crea y guarda sus propias figuras
+    '''
+    results=[]
+    if jobs<=1 or len(tasks)<=1:
+        for args, frames, prints in tasks:
+            results+=plot_task(args, frames)
+        close_caches()
+    else:
+        lost=[]
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures=[pool.submit(plot_task, args, frames) for args, frames, prints in tasks]
+            for future, task in zip(futures, tasks):
+                try:
+                    results+=future.result()
+                except BrokenProcessPool:
+                    #un proceso murió (p.ej. segfault de GEOS) y el pool ya no
+                    #sirve; no se sabe qué sección fue, se repiten por separado
+                    lost.append(task)
+                except Exception:
+                    results+=task_error(task, traceback.format_exc())
+        for task in lost:
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                try:
+                    results+=pool.submit(plot_task, task[0], task[1]).result()
+                except Exception:
+                    results+=task_error(task, traceback.format_exc())
+    return results
+
+def task_error(task, error):
+    '''
+    renglón de error para cada figura de la tarea cuyo proceso falló
+    '''
+    return [(figname, 0.0, error, {}) for figname in task[2]]
+
+def update_manifest(manifest, tasks, results):
+    '''
+    registra en el manifiesto las figuras que se graficaron sin errores
+    '''
+    prints={}
+    for task in tasks:
+        prints.update(task[2])
+    for figname, t, error, stages in results:
+        figpath, fprint=prints[figname]
+        if error==None and fprint!=None:
+            manifest.update(figpath, fprint)
+    manifest.save()
+
+def run_batch(args_list, jobs=1, force=False, manifest=None, profile=None):
+    '''
+    grafica todas las secciones, en serie o en un pool de procesos
+    con manifest solo se grafican las figuras que cambiaron (o todas con force)
+    profile: archivo .csv o .json para el reporte de tiempos por etapa
+    '''
+    t0=time.perf_counter()
+    tasks, skipped=plan_batch(args_list, manifest, force)
+    results=execute_tasks(tasks, jobs)
+    if manifest!=None:
+        update_manifest(manifest, tasks, results)
+    print_summary(results, time.perf_counter()-t0, skipped)
+    if profile!=None:
+        records=[(r[0], r[3]) for r in results if r[3]]
+        timing.write_report(profile, records)
+        timing.print_stage_summary(records)
+        print('Reporte de tiempos:', profile)
+    return results
+
+if __name__=='__main__':
+    #parser.add_argument("--figname", help="Nombre de la figura")
+    args=parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s', stream=sys.stdout)
+
+    if args.config_file==None:
+        args_list=[args]
+    elif is_job_file(args.config_file):
+        print('Reading:',args.config_file)
+        try:
+            args_list=load_jobs(args.config_file, parser)
+        except JobError as err:
+            print(err)
+            sys.exit(2)
+        duplicates=duplicate_outputs(args_list)
+        if duplicates and not args.check:
+            print('Errores en {}:\n\t'.format(args.config_file)+'\n\t'.join(duplicates))
+            sys.exit(2)
+        print('Trabajos:', len(args_list))
+    else:
+        args_list=[]
+        print('Reading:',args.config_file)
+        file_parser=ConfigParser()
+        file_parser.read(args.config_file)
+        print('Variables detectadas:', )
+        for section_name in file_parser.sections():
+            print('\t> ',section_name)
+            arg_line=shlex.split('--var_name='+section_name+' '+\
+                    file_parser.get(section_name,'options'))
+            args_list.append(parser.parse_args(arg_line))
+    apply_batch_options(args_list, args)
+    if not args.check:
+        errors=['{}: {}'.format(section.var_name, error)
+                for section in args_list for error in option_errors(section)]
+        if errors:
+            parser.error('\n'.join(errors))
+    if args.check:
+        errors=validate(args_list)+duplicate_outputs(args_list)
+        for error in errors:
+            print('\t'+error)
+        print('Secciones:', len(args_list), 'errores:', len(errors))
+        sys.exit(1 if errors else 0)
+    if any(section.auto_scale for section in args_list):
+        auto_scale(args_list, ScaleCache())
+    manifest=Manifest() if not args.no_manifest else None
+    results=run_batch(args_list, args.jobs, args.force, manifest, args.profile)
+    if any(r[2]!=None for r in results):
+        sys.exit(1)
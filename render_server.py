@@ -0,0 +1,202 @@
+'''
+servidor de graficado: mantiene cargados numpy, netCDF4, matplotlib y cartopy,
+las geometrías de costa/batimetría, los archivos abiertos con sus coordenadas
+y los mapas base (--template) entre solicitudes, para que cada trabajo solo
+pague la lectura y el dibujo.
+
+protocolo: una solicitud JSON por línea y una respuesta JSON por línea
+    {"id": 1, "options": "--tipo=clim --stat=media --modelo=HYCOM --filename=t.nc --level=0 ..."}
+    {"id": 2, "section": "temperatura", "options": "...", "force": true}
+"options" es la misma cadena que options de una sección del archivo .inf y
+"section" hace de --var_name como el nombre de la sección; "options" también
+puede ser un objeto con las llaves de un archivo de trabajos. Respuesta:
+    {"id": 1, "ok": true, "seconds": 1.2, "skipped": 0,
+     "figures": [{"figname": ..., "path": ..., "seconds": ..., "error": null,
+                  "stages": {"read": ..., "savefig": ...}}]}
+{"cmd": "quit"} termina el servidor.
+
+    python3 render_server.py                          # stdin/stdout
+    python3 render_server.py --socket /tmp/plot.sock  # socket Unix
+'''
+import os
+import sys
+import json
+import time
+import shlex
+import argparse as ap
+import logging
+import traceback
+import socketserver
+from contextlib import redirect_stdout
+import cartopy.crs as ccrs
+import plot_fig
+import geom_cache
+from map_plots import global_plot_params
+from manifest import Manifest
+from jobs import make_args, missing_options, option_errors
+
+#dominio que se pre-calienta por omisión (Golfo de México)
+DEFAULT_EXTENT=[-98, -77, 18, 32]
+
+class RequestError(Exception):
+    pass
+
+def parse_request(request):
+    '''
+    opciones resueltas de la solicitud, como una sección del archivo .inf;
+    "options" también puede ser un diccionario como un trabajo de jobs.py
+    '''
+    options=request.get('options', '')
+    section=request.get('section')
+    if section!=None and not isinstance(section, str):
+        raise RequestError('"section" debe ser una cadena')
+    if isinstance(options, dict):
+        options=dict(options)
+        if section!=None:
+            options['var_name']=section
+        args, errors=make_args(options, plot_fig.parser)
+    elif isinstance(options, str):
+        if section!=None:
+            options='--var_name='+section+' '+options
+        try:
+            args=plot_fig.parser.parse_args(shlex.split(options))
+        except (SystemExit, ValueError):
+            #argparse ya escribió el detalle en stderr
+            raise RequestError('Opciones inválidas: '+options)
+        errors=missing_options(args)+option_errors(args)
+    else:
+        raise RequestError('"options" debe ser una cadena o un objeto JSON')
+    if errors:
+        raise RequestError('Opciones inválidas: '+'; '.join(errors))
+    if args.config_file!=None:
+        raise RequestError('-i no se admite en el servidor, enviar una solicitud por sección')
+    return args
+
+class RenderServer:
+    '''
+    atiende solicitudes en el mismo proceso; las figuras nunca usan pyplot
+    '''
+    def __init__(self, template=False, manifest=None):
+        self.template=template
+        self.manifest=manifest
+
+    def warm(self, extents):
+        global_plot_params()
+        for extent in extents:
+            geom_cache.warm(extent, ccrs.PlateCarree())
+
+    def handle(self, request):
+        t0=time.perf_counter()
+        args=parse_request(request)
+        args.agg=True
+        args.template=args.template or self.template
+        #solo activa la medición por etapa; los tiempos van en la respuesta
+        args.profile=args.profile or 'servidor'
+        if args.auto_scale:
+            plot_fig.auto_scale([args], plot_fig.ScaleCache())
+        manifest=self.manifest if not args.no_manifest else None
+        tasks, skipped=plot_fig.plan_batch([args], manifest, request.get('force', False))
+        figures=[]
+        for task_args, frames, prints in tasks:
+            for figname, seconds, error, stages in plot_fig.plot_task(task_args, frames):
+                path, fprint=prints[figname]
+                if manifest!=None and error==None and fprint!=None:
+                    manifest.update(path, fprint)
+                figures.append({'figname':figname, 'path':path, 'seconds':seconds,
+                    'error':error, 'stages':stages})
+        if manifest!=None and len(tasks)>0:
+            manifest.save()
+        return {'ok':all(f['error']==None for f in figures),
+                'seconds':time.perf_counter()-t0,
+                'skipped':skipped,
+                'figures':figures}
+
+    def respond(self, line):
+        '''
+        procesa una línea del protocolo; regresa (respuesta, continuar)
+        '''
+        try:
+            request=json.loads(line)
+        except ValueError as err:
+            return {'ok':False, 'error':'JSON inválido: '+str(err)}, True
+        if not isinstance(request, dict):
+            return {'ok':False, 'error':'La solicitud debe ser un objeto JSON'}, True
+        if request.get('cmd')=='quit':
+            plot_fig.close_caches()
+            return {'id':request.get('id'), 'ok':True}, False
+        #la salida informativa de plot_fig no debe mezclarse con el protocolo
+        with redirect_stdout(sys.stderr):
+            try:
+                response=self.handle(request)
+            except RequestError as err:
+                response={'ok':False, 'error':str(err)}
+            except Exception:
+                #un error inesperado solo falla esta solicitud
+                response={'ok':False, 'error':traceback.format_exc()}
+        response['id']=request.get('id')
+        return response, True
+
+    def serve_stream(self, infile, outfile):
+        for line in infile:
+            if not line.strip():
+                continue
+            response, running=self.respond(line)
+            outfile.write(json.dumps(response)+'\n')
+            outfile.flush()
+            if not running:
+                return False
+        return True
+
+    def serve_socket(self, path):
+        '''
+        atiende una conexión a la vez: matplotlib no es seguro entre hilos
+        '''
+        server=self
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                lines=(line.decode('utf-8') for line in self.rfile)
+                writer=_LineWriter(self.wfile)
+                if not server.serve_stream(lines, writer):
+                    self.server.running=False
+        if os.path.exists(path):
+            os.remove(path)
+        with socketserver.UnixStreamServer(path, Handler) as sock:
+            sock.running=True
+            print('Escuchando en', path, file=sys.stderr)
+            while sock.running:
+                sock.handle_request()
+        os.remove(path)
+
+class _LineWriter:
+    def __init__(self, wfile):
+        self.wfile=wfile
+
+    def write(self, text):
+        self.wfile.write(text.encode('utf-8'))
+
+    def flush(self):
+        self.wfile.flush()
+
+if __name__=='__main__':
+    parser=ap.ArgumentParser(description='Servidor de graficado (JSON por línea)')
+    parser.add_argument("--socket", help="Ruta del socket Unix; por omisión stdin/stdout")
+    parser.add_argument("--extent", type=float, nargs=4, action='append',
+            metavar=('LONMIN','LONMAX','LATMIN','LATMAX'),
+            help="Dominio a pre-calentar en el cache de geometrías (se puede repetir)")
+    parser.add_argument("--template", action="store_true",
+            help="Reutiliza el mapa base entre solicitudes")
+    parser.add_argument("--no_manifest", action="store_true",
+            help="No usa el manifiesto: grafica siempre")
+    args=parser.parse_args()
+    #avance de plot_fig en stderr; stdout es del protocolo
+    logging.basicConfig(level=logging.INFO, format='%(message)s', stream=sys.stderr)
+
+    server=RenderServer(template=args.template,
+            manifest=Manifest() if not args.no_manifest else None)
+    server.warm(args.extent or [DEFAULT_EXTENT])
+    print('Listo', file=sys.stderr)
+    if args.socket!=None:
+        server.serve_socket(args.socket)
+    else:
+        server.serve_stream(sys.stdin, sys.stdout)
+    plot_fig.close_caches()
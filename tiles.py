@@ -0,0 +1,134 @@
+'''
+teselas XYZ (slippy map) en Web Mercator para el visor web
+cada nivel de zoom z divide el mundo en 2**z x 2**z teselas de 256x256 pixeles
+guardadas como <carpeta>/<z>/<x>/<y>.png; las teselas sin datos (fuera de la
+malla o solo tierra) no se escriben. En <carpeta>/tiles.json quedan los límites,
+zooms y la escala de color usados.
+
+    render_tiles(lon, lat, var, 'Figuras/sst_tiles', zooms=[4,5,6], cmap='jet')
+'''
+import os
+import json
+import math
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from nc_reader import extent_window
+
+TILE_SIZE=256
+#latitud máxima de Web Mercator
+MAX_LAT=85.0511287798
+
+def mercator_y(lat):
+    '''
+    latitud a coordenada y de Mercator en grados (lineal en pixeles de la tesela)
+    '''
+    lat=np.clip(lat, -MAX_LAT, MAX_LAT)
+    return np.degrees(np.log(np.tan(np.pi/4+np.radians(lat)/2)))
+
+def tile_bounds(x, y, zoom):
+    '''
+    [lonmin, lonmax, latmin, latmax] de la tesela (x, y) en el zoom
+    '''
+    n=2**zoom
+    lonmin=x/n*360.-180.
+    lonmax=(x+1)/n*360.-180.
+    latmax=math.degrees(math.atan(math.sinh(math.pi*(1-2*y/n))))
+    latmin=math.degrees(math.atan(math.sinh(math.pi*(1-2*(y+1)/n))))
+    return [lonmin, lonmax, latmin, latmax]
+
+def tile_index(lon, lat, zoom):
+    '''
+    tesela (x, y) que contiene el punto
+    '''
+    n=2**zoom
+    lat=min(max(lat, -MAX_LAT), MAX_LAT)
+    x=int((lon+180.)/360.*n)
+    y=int((1-math.asinh(math.tan(math.radians(lat)))/math.pi)/2*n)
+    return min(max(x, 0), n-1), min(max(y, 0), n-1)
+
+def tile_range(extent, zoom):
+    '''
+    lista de (zoom, x, y) de las teselas que cubren extent
+    '''
+    x0, y0=tile_index(extent[0], extent[3], zoom)
+    x1, y1=tile_index(extent[1], extent[2], zoom)
+    return [(zoom, x, y) for x in range(x0, x1+1) for y in range(y0, y1+1)]
+
+#datos de la rebanada en cada proceso: lon, lat, var, cmap, vmin, vmax, margen
+_data=None
+
+def _init(lon, lat, var, cmap, vmin, vmax):
+    global _data
+    #margen de una celda para que las teselas más pequeñas que la malla tengan datos
+    pad=max(float(np.abs(np.diff(lon, axis=-1)).max()),
+            float(np.abs(np.diff(lat, axis=0)).max()))
+    _data=(lon, lat, var, cmap, vmin, vmax, pad)
+
+def render_tile(root, zoom, x, y):
+    '''
+    dibuja una tesela; regresa False si no tiene datos y no se escribió
+    '''
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    lon, lat, var, cmap, vmin, vmax, pad=_data
+    bounds=tile_bounds(x, y, zoom)
+    try:
+        slat, slon=extent_window(lon, lat,
+                [bounds[0]-pad, bounds[1]+pad, bounds[2]-pad, bounds[3]+pad])
+    except ValueError:
+        return False
+    sub=var[slat, slon]
+    if np.ma.count(sub)==0:
+        #solo tierra o sin datos
+        return False
+    if lon.ndim==1:
+        sublon, sublat=lon[slon], lat[slat]
+    else:
+        sublon, sublat=lon[slat, slon], lat[slat, slon]
+
+    fig=Figure(figsize=(1, 1), dpi=TILE_SIZE)
+    FigureCanvasAgg(fig)
+    ax=fig.add_axes([0, 0, 1, 1])
+    ax.set_axis_off()
+    ax.pcolormesh(sublon, mercator_y(sublat), sub, cmap=cmap, vmin=vmin, vmax=vmax,
+            shading='auto')
+    ax.set_xlim(bounds[0], bounds[1])
+    ax.set_ylim(mercator_y(bounds[2]), mercator_y(bounds[3]))
+    dirname=os.path.join(root, str(zoom), str(x))
+    os.makedirs(dirname, exist_ok=True)
+    fig.savefig(os.path.join(dirname, '{}.png'.format(y)), dpi=TILE_SIZE, transparent=True)
+    return True
+
+def _render_chunk(root, tiles):
+    return sum(render_tile(root, *tile) for tile in tiles)
+
+def render_tiles(lon, lat, var, root, zooms, cmap='viridis', vmin=None, vmax=None, jobs=None):
+    '''
+    escribe la pirámide de teselas de la rebanada (lon, lat 1D o 2D; var 2D)
+    vmin/vmax: escala de color común a todas las teselas (por omisión mínimo y
+    máximo de la rebanada); jobs: procesos (por omisión uno por CPU)
+    regresa el diccionario guardado en tiles.json
+    '''
+    var=np.ma.masked_invalid(np.squeeze(var))
+    if vmin==None:
+        vmin=float(np.ma.min(var))
+    if vmax==None:
+        vmax=float(np.ma.max(var))
+    extent=[float(np.min(lon)), float(np.max(lon)),
+            float(max(np.min(lat), -MAX_LAT)), float(min(np.max(lat), MAX_LAT))]
+    tiles=[tile for zoom in zooms for tile in tile_range(extent, zoom)]
+    jobs=jobs or os.cpu_count() or 1
+    if jobs>1 and len(tiles)>1:
+        chunks=[tiles[i::jobs] for i in range(jobs)]
+        with ProcessPoolExecutor(jobs, initializer=_init,
+                initargs=(lon, lat, var, cmap, vmin, vmax)) as pool:
+            written=sum(pool.map(_render_chunk, [root]*len(chunks), chunks))
+    else:
+        _init(lon, lat, var, cmap, vmin, vmax)
+        written=_render_chunk(root, tiles)
+    meta={'extent':extent, 'zooms':list(zooms), 'cmap':cmap, 'vmin':vmin, 'vmax':vmax,
+            'tiles':written, 'empty':len(tiles)-written}
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, 'tiles.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+    return meta
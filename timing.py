@@ -0,0 +1,98 @@
+'''
+instrumentación de tiempos por etapa del graficado
+las etapas se miden con span('nombre') solo mientras hay una figura activa
+(start_figure/end_figure), de lo contrario no tienen costo.
+
+    start_figure('figura')
+    with span('read'):
+        ...
+    stages=end_figure()   # {'read': segundos, ...}
+'''
+import os
+import csv
+import time
+import json
+from contextlib import contextmanager
+
+#tiempos acumulados de la figura activa, None si no se está midiendo
+_current=None
+
+def start_figure():
+    global _current
+    _current={}
+
+def end_figure():
+    '''
+    termina la figura activa y regresa {etapa: segundos}
+    '''
+    global _current
+    stages, _current=_current, None
+    return stages if stages!=None else {}
+
+def enabled():
+    return _current!=None
+
+@contextmanager
+def span(name):
+    '''
+    acumula el tiempo del bloque en la etapa name de la figura activa
+    '''
+    if _current==None:
+        yield
+        return
+    t0=time.perf_counter()
+    try:
+        yield
+    finally:
+        if _current!=None:
+            _current[name]=_current.get(name, 0.0)+time.perf_counter()-t0
+
+def timed_artist(artist, name):
+    '''
+    mide el dibujo del artista (p.ej. las capas de cartopy, que leen y proyectan
+    las geometrías hasta que se dibujan en savefig)
+    '''
+    if _current==None:
+        return artist
+    draw=artist.draw
+    def timed_draw(renderer, *args, **kwargs):
+        with span(name):
+            return draw(renderer, *args, **kwargs)
+    artist.draw=timed_draw
+    return artist
+
+def write_report(path, records):
+    '''
+    escribe el reporte por figura en CSV (figname, stage, seconds) o JSON según
+    la extensión de path; records es lista de (figname, {etapa: segundos})
+    '''
+    dirname=os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    if path.endswith('.json'):
+        with open(path, 'w') as f:
+            json.dump([{'figname':figname, 'stages':stages} for figname, stages in records],
+                    f, indent=1)
+        return
+    with open(path, 'w', newline='') as f:
+        writer=csv.writer(f)
+        writer.writerow(['figname','stage','seconds'])
+        for figname, stages in records:
+            for stage, seconds in stages.items():
+                writer.writerow([figname, stage, '{:.6f}'.format(seconds)])
+
+def print_stage_summary(records, top=10):
+    '''
+    tabla de las etapas más lentas en todo el lote
+    '''
+    totals={}
+    for figname, stages in records:
+        for stage, seconds in stages.items():
+            total, count, worst=totals.get(stage, (0.0, 0, 0.0))
+            totals[stage]=(total+seconds, count+1, max(worst, seconds))
+    print('Etapas más lentas:')
+    print('\t{:<20} {:>10} {:>6} {:>10} {:>10}'.format('etapa','total s','n','media s','máx s'))
+    rows=sorted(totals.items(), key=lambda item: -item[1][0])[:top]
+    for stage, (total, count, worst) in rows:
+        print('\t{:<20} {:>10.3f} {:>6d} {:>10.3f} {:>10.3f}'.format(
+            stage, total, count, total/count, worst))
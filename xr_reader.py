@@ -0,0 +1,131 @@
+'''
+lectura con xarray y dask para salidas repartidas en muchos archivos o más
+grandes que la memoria (opcional: requiere xarray y dask)
+los archivos se abren con open_mfdataset en bloques (chunks) y solo se calcula
+la rebanada final; con stat la estadística se calcula sobre el eje de tiempo
+bloque por bloque, sin archivos climanual_*.nc precalculados.
+
+    root=open_dataset('diarios/*.nc', {'time':30})
+    lon, lat, var, z=read_slice(root, 'pot_temp', 'Longitude', 'Latitude', 'Depth',
+            level=100, stat='media', month=1)
+'''
+import importlib.util
+import numpy as np
+from nc_reader import extent_window, find_level, month_index
+
+#reducción sobre el tiempo de cada --stat
+REDUCTIONS={'media':'mean',
+        'promedio':'mean',
+        'desviacion-estandar':'std',
+        'maximos':'max',
+        'minimos':'min',
+        }
+
+def parse_chunks(value):
+    '''
+    'time=30,Depth=1' -> {'time':30, 'Depth':1}
+    '''
+    chunks={}
+    for item in value.split(','):
+        name, _, size=item.partition('=')
+        chunks[name.strip()]=int(size)
+    return chunks
+
+def open_dataset(pattern, chunks=None):
+    '''
+    abre uno o varios archivos (patrón glob) como un solo dataset perezoso
+    '''
+    message='--backend=xarray requiere xarray y dask (pip install xarray dask netCDF4)'
+    #dask solo se necesita instalado: lo usa open_mfdataset con chunks
+    if importlib.util.find_spec('dask') is None:
+        raise ImportError(message)
+    try:
+        import xarray as xr
+    except ImportError:
+        raise ImportError(message)
+    return xr.open_mfdataset(pattern, combine='by_coords', chunks=chunks or {},
+            data_vars='minimal', coords='minimal', compat='override', parallel=False)
+
+def time_dims(var, depth_dim=None):
+    '''
+    dimensiones de la variable que no son horizontales ni profundidad
+    '''
+    return [dim for dim in var.dims[:-2] if dim!=depth_dim]
+
+def read_slice(root, var_name, lon_name='longitude', lat_name='latitude',
+        depth_name='depth', level=None, time=0, extent=None, method='exact',
+        stat=None, month=None):
+    '''
+    igual que nc_reader.read_slice; con stat se reduce el eje de tiempo con la
+    estadística de --stat (solo los pasos del mes month si no es None) en
+    lugar de tomar el paso time. Regresa lon, lat, var, profundidad usada
+    '''
+    var=root[var_name]
+    lon=np.asarray(root[lon_name].values)
+    lat=np.asarray(root[lat_name].values)
+    ydim, xdim=var.dims[-2:]
+    if extent is not None:
+        slat, slon=extent_window(lon, lat, extent)
+        var=var.isel({ydim:slat, xdim:slon})
+        if lon.ndim==1:
+            lon, lat=lon[slon], lat[slat]
+        else:
+            lon, lat=lon[slat, slon], lat[slat, slon]
+
+    zdim=None
+    zvalue=None
+    if level is not None:
+        if depth_name in root.variables:
+            zdim=root[depth_name].dims[0]
+        if zdim not in var.dims:
+            raise ValueError('{} no tiene dimensión de profundidad {}'.format(
+                var_name, depth_name))
+        levels, zvalue=find_level(root[depth_name].values, level, method)
+        var=sum(var.isel({zdim:ilevel})*weight for ilevel, weight in levels)
+
+    tdims=time_dims(var, zdim)
+    if stat is None:
+        var=var.isel({dim:time for dim in tdims})
+    else:
+        if stat not in REDUCTIONS:
+            raise ValueError('Estadística no soportada: '+str(stat))
+        if month is not None:
+            try:
+                months=var[tdims[0]].dt.month.values
+            except (IndexError, AttributeError, TypeError):
+                raise ValueError('{} no tiene eje de tiempo con fechas para elegir el mes'.format(var_name))
+            var=var.isel({tdims[0]:months==month})
+        var=getattr(var, REDUCTIONS[stat])(dim=tdims)
+    #solo aquí se leen los archivos y se calcula la reducción
+    data=np.ma.masked_invalid(np.asarray(var.values))
+    return lon, lat, data, zvalue
+
+def time_length(root, var_name, depth_name='depth'):
+    '''
+    número de pasos de tiempo de la variable (1 si no tiene dimensión de tiempo)
+    '''
+    var=root[var_name]
+    zdim=root[depth_name].dims[0] if depth_name in root.variables else None
+    size=1
+    for dim in time_dims(var, zdim):
+        size*=var.sizes[dim]
+    return size
+
+def time_index(root, var_name, month, depth_name='depth'):
+    '''
+    paso de tiempo del mes month (0 si la variable tiene un solo tiempo); el
+    mes se toma de las fechas del eje de tiempo, como nc_reader.time_index
+    '''
+    size=time_length(root, var_name, depth_name)
+    if size<=1:
+        return 0
+    var=root[var_name]
+    zdim=root[depth_name].dims[0] if depth_name in root.variables else None
+    tdims=time_dims(var, zdim)
+    months=None
+    if len(tdims)==1:
+        try:
+            months=var[tdims[0]].dt.month.values
+        except (AttributeError, TypeError):
+            months=None
+    return month_index(months, size, month)